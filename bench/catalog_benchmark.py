@@ -0,0 +1,361 @@
+import os
+import re
+import sys
+import csv
+import json
+import time
+import zlib
+import shutil
+import struct
+import sqlite3
+import hashlib
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+script_dir = os.path.dirname(os.path.realpath(__file__))
+root_dir = os.path.realpath(os.path.join(script_dir, ".."))
+src_dir = os.path.join(root_dir, "src")
+sys.path.insert(0, src_dir)
+
+from validate_resources import image_resource_specifications
+
+# Scaling benchmark on synthetic catalogs, the repo itself only holds a handful of tokens.
+# For each catalog size it generates a checkout with that many characters (and one bundle per 100)
+# in characters_master.csv, bundles.csv and index.csv, with dummy assets whose headers carry the
+# spec dimensions, then runs the build, mirror and validate steps on it as separate processes.
+# The mirror step downloads from a local stand-in for the CDN, IPFS gateway and Sia portal.
+# Throughput, CPU, I/O and peak RSS of every step go to a JSON file named after the commit,
+# and --baseline compares against the file of an earlier commit.
+
+# bump when the layout of the results changes
+results_version = 1
+
+stages = ["build", "mirror", "validate"]
+
+character_resources = ['card_low.jpg', 'card.png', 'artwork_low.jpg', 'artwork.png', 'video.mp4', 'character.json']
+bundle_resources = ['card_low.jpg', 'card.png']
+
+# characters_master.csv column holding the sia:// URL of each resource
+sia_columns = {
+  'card_low.jpg': 'card_low_sia',
+  'card.png': 'card_high_sia',
+  'artwork_low.jpg': 'artwork_low_sia',
+  'artwork.png': 'artwork_high_sia',
+  'video.mp4': 'video_sia',
+  'character.json': 'character_sia',
+  'nvla.json': 'novellia_sia',
+}
+
+nanoid_alphabet = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+def nanoid(i):
+  n = int.from_bytes(hashlib.sha256("bench-{}".format(i).encode()).digest()[:8], "big")
+  chars = []
+  for _ in range(12):
+    n, c = divmod(n, len(nanoid_alphabet))
+    chars.append(nanoid_alphabet[c])
+  return "".join(chars)
+
+def skylink(nanoid, name):
+  # 46 characters like a real skylink, unique per file
+  return hashlib.sha256("{}/{}".format(nanoid, name).encode()).hexdigest()[:46]
+
+def png_chunk(kind, data):
+  return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+def dummy_png(width, height, tag, size):
+  # a PNG header at the given dimensions, tagged and padded with tEXt chunks, without pixel data
+  header = b'\x89PNG\r\n\x1a\n' + png_chunk(b'IHDR', struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+  header += png_chunk(b'tEXt', b'Comment\x00' + tag)
+  padding = max(0, size - len(header) - 12 - 12 - len(b'Padding\x00'))
+  return header + png_chunk(b'tEXt', b'Padding\x00' + b' ' * padding) + png_chunk(b'IEND', b'')
+
+def dummy_jpeg(width, height, tag, size):
+  # a JPEG whose COM segments carry the tag and padding, followed by a baseline SOF at the given dimensions
+  comment = tag + b' ' * max(0, size - len(tag) - 2 - 21 - 2)
+  segments = b''
+  while True:
+    part, comment = comment[:65533], comment[65533:]
+    segments += b'\xff\xfe' + struct.pack(">H", len(part) + 2) + part
+    if not comment:
+      break
+  sof = b'\xff\xc0' + struct.pack(">HBHHB", 17, 8, height, width, 3) + b'\x01\x22\x00\x02\x11\x01\x03\x11\x01'
+  return b'\xff\xd8' + segments + sof + b'\xff\xd9'
+
+def dummy_mp4(tag, size):
+  ftyp = struct.pack(">I", 24) + b'ftypisom' + struct.pack(">I", 0x200) + b'isommp41'
+  payload = tag + b' ' * max(0, size - len(ftyp) - 8 - len(tag))
+  return ftyp + struct.pack(">I", len(payload) + 8) + b'free' + payload
+
+def dummy_asset(name, tag, size):
+  if name.endswith(".png") or name.endswith(".jpg"):
+    spec = image_resource_specifications[name]
+    width, height = int(spec["width"]), int(spec["height"])
+    return dummy_png(width, height, tag, size) if name.endswith(".png") else dummy_jpeg(width, height, tag, size)
+  if name.endswith(".mp4"):
+    return dummy_mp4(tag, size)
+  return json.dumps({"name": tag.decode(), "health": 10, "attack": 3, "move": 1}).encode()
+
+def write_csv(path, fieldnames, rows):
+  with open(path, 'w', newline='') as f:
+    writer = csv.DictWriter(f, fieldnames=fieldnames)
+    writer.writeheader()
+    writer.writerows(rows)
+
+def generate_catalog(work_dir, products, asset_bytes):
+  # writes a synthetic checkout to work_dir, returns {skylink: file path} for the Sia stand-in
+  for d in ["config", "data", "index", "static"]:
+    os.makedirs(os.path.join(work_dir, d), exist_ok=True)
+  for name in ["organization.csv", "market.csv"]:
+    shutil.copy(os.path.join(root_dir, "data", name), os.path.join(work_dir, "data", name))
+  with open(os.path.join(root_dir, "config", "config.yaml"), 'r') as f:
+    cfg_text = f.read()
+  include_cards = "include_cards: [{}]".format(",".join(str(i + 1) for i in range(products)))
+  with open(os.path.join(work_dir, "config", "config.yaml"), 'w') as f:
+    f.write(re.sub(r"(?m)^include_cards:.*$", include_cards, cfg_text))
+
+  # the real characters serve as templates, so text columns keep realistic lengths
+  with open(os.path.join(root_dir, "data", "characters_master.csv"), 'r', newline='') as f:
+    reader = csv.DictReader(f)
+    character_columns = reader.fieldnames
+    templates = list(reader)
+  with open(os.path.join(root_dir, "data", "bundles.csv"), 'r', newline='') as f:
+    reader = csv.DictReader(f)
+    bundle_columns = reader.fieldnames
+    bundle_templates = list(reader)
+
+  sia = {}
+  characters = []
+  bundles = []
+  index = []
+
+  def write_product(product_id, name, resources):
+    nid = nanoid(len(index))
+    index.append({"name": name, "product_id": product_id, "nanoid": nid})
+    resource_dir = os.path.join(work_dir, "static", nid, "resource")
+    os.makedirs(resource_dir)
+    for r in resources:
+      path = os.path.join(resource_dir, r)
+      with open(path, 'wb') as f:
+        f.write(dummy_asset(r, "{} {}".format(nid, r).encode(), asset_bytes))
+      sia[skylink(nid, r)] = path
+    sia[skylink(nid, "nvla.json")] = os.path.join(work_dir, "static", nid, "nvla.json")
+    return nid
+
+  for i in range(products):
+    row = dict(templates[i % len(templates)])
+    row["product_id"] = "PROD-{:026d}".format(i)
+    row["product_name"] = "Synthetic {}".format(i)
+    row["card_number"] = i + 1
+    nid = write_product(row["product_id"], row["product_name"], character_resources)
+    for r, column in sia_columns.items():
+      row[column] = "sia://{}".format(skylink(nid, r))
+    characters.append(row)
+
+  for i in range(max(1, products // 100)):
+    row = dict(bundle_templates[i % len(bundle_templates)])
+    row["product_id"] = "PROD-B{:025d}".format(i)
+    row["product_name"] = "Synthetic Bundle {}".format(i)
+    write_product(row["product_id"], row["product_name"], bundle_resources)
+    bundles.append(row)
+
+  write_csv(os.path.join(work_dir, "data", "characters_master.csv"), character_columns, characters)
+  write_csv(os.path.join(work_dir, "data", "bundles.csv"), bundle_columns, bundles)
+  write_csv(os.path.join(work_dir, "index", "index.csv"), ["name", "product_id", "nanoid"], index)
+  return sia
+
+class StandIn:
+  # serves static/ as the CDN, files by multihash as the IPFS gateway and by skylink as the Sia portal
+  def __init__(self, work_dir, sia):
+    self.static_dir = os.path.join(work_dir, "static")
+    self.sia = sia
+    self.ipfs = {}
+    stand_in = self
+
+    class Handler(SimpleHTTPRequestHandler):
+      protocol_version = "HTTP/1.1"
+
+      def log_message(self, *args):
+        pass
+
+      def translate_path(self, path):
+        path = path.split("?")[0]
+        if path.startswith("/static/"):
+          return os.path.join(stand_in.static_dir, path[len("/static/"):])
+        if path.startswith("/ipfs/"):
+          return stand_in.ipfs.get(path[len("/ipfs/"):], "/nonexistent")
+        if path.startswith("/sia/"):
+          return stand_in.sia.get(path[len("/sia/"):], "/nonexistent")
+        return "/nonexistent"
+
+    self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    self.server.daemon_threads = True
+    self.url = "http://127.0.0.1:{}".format(self.server.server_address[1])
+    self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+    self.thread.start()
+
+  def load_ipfs(self, hash_cache_db):
+    # every file the build hashed, resources, nvla.json and onchain.json, by multihash
+    conn = sqlite3.connect(hash_cache_db)
+    self.ipfs = dict(conn.execute("SELECT multihash, path FROM multihash"))
+    conn.close()
+
+  def close(self):
+    self.server.shutdown()
+    self.server.server_close()
+
+def run_stage(work_dir, stage, step_argv, jobs, log_path):
+  # runs one pipeline step in its own process, returns its measurements
+  trace_path = os.path.join(work_dir, "cache", "profile_{}.json".format(stage))
+  cmd = [sys.executable, os.path.join(src_dir, "pipeline.py"), "--root", work_dir, "--jobs", str(jobs), "--profile", trace_path, stage] + step_argv
+  with open(log_path, 'a') as log:
+    start = time.perf_counter()
+    process = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT)
+    # wait4 rather than wait for the rusage of the step and the pool workers it waited for
+    _, status, rusage = os.wait4(process.pid, 0)
+    seconds = time.perf_counter() - start
+  process.returncode = os.waitstatus_to_exitcode(status)
+  result = {
+    "seconds": seconds,
+    "cpu_seconds": rusage.ru_utime + rusage.ru_stime,
+    "peak_rss_bytes": rusage.ru_maxrss * (1 if sys.platform == "darwin" else 1024),
+    "exit_code": process.returncode,
+  }
+  try:
+    with open(trace_path, 'r') as f:
+      span = json.load(f)["run"]["spans"][0]
+    for key in ["read_bytes", "written_bytes", "forks"]:
+      if key in span:
+        result[key] = span[key]
+  except (FileNotFoundError, KeyError, IndexError):
+    pass
+  return result
+
+def log_tail(log_path, lines=20):
+  with open(log_path, 'r') as f:
+    return "".join(f.readlines()[-lines:])
+
+def benchmark(products, work_dir, jobs, asset_bytes, selected):
+  # returns {stage: measurements} for one catalog size
+  start = time.perf_counter()
+  sia = generate_catalog(work_dir, products, asset_bytes)
+  generate_seconds = time.perf_counter() - start
+  bundles = max(1, products // 100)
+  files = products * len(character_resources) + bundles * len(bundle_resources)
+  print("generated {} products and {} files in {:.1f}s".format(products + bundles, files, generate_seconds))
+
+  stand_in = StandIn(work_dir, sia)
+  log_path = os.path.join(work_dir, "benchmark.log")
+  results = {}
+  try:
+    for stage in stages:
+      if stage not in selected:
+        continue
+      step_argv = []
+      if stage == "mirror":
+        stand_in.load_ipfs(os.path.join(work_dir, "cache", "multihash.sqlite"))
+        # the asset store already holds every original, --fetch-known still downloads them from each backend
+        step_argv = ["--fetch-known", "--static-host", stand_in.url + "/static", "--ipfs-gateway", stand_in.url + "/ipfs/", "--sia-portal", stand_in.url + "/sia/"]
+      if stage == "validate":
+        report_path = os.path.join(work_dir, "cache", "validate_report.json")
+        step_argv = ["--report", report_path]
+      result = run_stage(work_dir, stage, step_argv, jobs, log_path)
+      result["products_per_second"] = (products + bundles) / result["seconds"]
+      result["files_per_second"] = files / result["seconds"]
+      if stage == "validate":
+        # the dummy PNGs are far below the 2 MB min_size, so validate always reports failures
+        with open(report_path, 'r') as f:
+          result["checks"] = json.load(f)["summary"]["checks"]
+      elif result["exit_code"] != 0:
+        raise RuntimeError("{} failed on {} products:\n{}".format(stage, products, log_tail(log_path)))
+      results[stage] = result
+      print("{:>8} {:>9}: {:8.2f}s {:9.0f} products/s {:9.1f}s cpu {:8.1f} MB peak RSS".format(
+        products, stage, result["seconds"], result["products_per_second"], result["cpu_seconds"], result["peak_rss_bytes"] / 1e6))
+  finally:
+    stand_in.close()
+  return {"products": products + bundles, "files": files, "generate_seconds": generate_seconds, "stages": results}
+
+def git(*args):
+  try:
+    return subprocess.run(["git"] + list(args), cwd=root_dir, capture_output=True, text=True, check=True).stdout.strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+def compare(results, baseline, max_ratio):
+  # prints time and peak RSS relative to the baseline, returns False if a stage got slower than max_ratio
+  ok = True
+  previous = {(r["products"], stage): m for r in baseline["results"] for stage, m in r["stages"].items()}
+  print("relative to {}:".format(baseline.get("commit")))
+  for r in results:
+    for stage, m in r["stages"].items():
+      b = previous.get((r["products"], stage))
+      if b is None:
+        continue
+      ratio = m["seconds"] / b["seconds"]
+      print("{:>8} {:>9}: {:5.2f}x time {:5.2f}x peak RSS".format(r["products"], stage, ratio, m["peak_rss_bytes"] / b["peak_rss_bytes"]))
+      if max_ratio is not None and ratio > max_ratio:
+        print("{} on {} products is {:.2f} times slower than the baseline > {}".format(stage, r["products"], ratio, max_ratio))
+        ok = False
+  return ok
+
+def main():
+  parser = argparse.ArgumentParser(description="Benchmark build, mirror and validate on synthetic catalogs of increasing size")
+  parser.add_argument("--sizes", default="10,1000,10000,100000", help="comma separated numbers of characters per catalog")
+  parser.add_argument("--stages", nargs="+", choices=stages, default=stages, help="steps to run, mirror needs build")
+  parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="--jobs passed to every step")
+  parser.add_argument("--asset-bytes", type=int, default=2048, help="size of every dummy image and video")
+  parser.add_argument("--work-dir", help="where the catalogs are generated, a temporary directory by default")
+  parser.add_argument("--keep", action="store_true", help="keep the generated catalogs")
+  parser.add_argument("--output", help="results JSON, cache/catalog_benchmark_<commit>.json by default")
+  parser.add_argument("--baseline", help="results JSON of an earlier run to compare against")
+  parser.add_argument("--max-ratio", type=float, help="with --baseline, fail if a stage is more than this many times slower")
+  args = parser.parse_args()
+  if "mirror" in args.stages and "build" not in args.stages:
+    parser.error("the mirror stage needs the build stage")
+
+  commit = git("rev-parse", "--short", "HEAD") or "unknown"
+  work_root = args.work_dir or tempfile.mkdtemp(prefix="catalog_benchmark_")
+  results = []
+  try:
+    for size in [int(s) for s in args.sizes.split(",")]:
+      work_dir = os.path.realpath(os.path.join(work_root, "catalog_{}".format(size)))
+      if os.path.exists(work_dir):
+        shutil.rmtree(work_dir)
+      results.append(benchmark(size, work_dir, args.jobs, args.asset_bytes, args.stages))
+      if not args.keep:
+        shutil.rmtree(work_dir)
+  finally:
+    if not args.keep and not args.work_dir:
+      shutil.rmtree(work_root, ignore_errors=True)
+
+  output = {
+    "version": results_version,
+    "commit": commit,
+    # uncommitted changes to tracked files, the numbers don't belong to the commit alone
+    "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+    "date": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    "python": platform.python_version(),
+    "platform": platform.platform(),
+    "cpu_count": os.cpu_count(),
+    "jobs": args.jobs,
+    "asset_bytes": args.asset_bytes,
+    "results": results,
+  }
+  output_path = args.output or os.path.join(root_dir, "cache", "catalog_benchmark_{}.json".format(commit))
+  os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+  with open(output_path, 'w') as f:
+    json.dump(output, f, indent=2)
+  print("wrote {}".format(output_path))
+
+  if args.baseline:
+    with open(args.baseline, 'r') as f:
+      baseline = json.load(f)
+    if not compare(results, baseline, args.max_ratio):
+      sys.exit(1)
+
+if __name__ == "__main__":
+  main()
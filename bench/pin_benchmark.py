@@ -0,0 +1,205 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import shutil
+import argparse
+import tempfile
+import threading
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+script_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(script_dir, "../src"))
+
+from ipfs_multihash import UnixfsHasher, get_ipfs_multihash, chunk_size, max_links
+from pin_client import PinClient
+
+# Throughput and accounting check of pin_client.PinClient against a local stand-in for the IPFS HTTP API.
+# The stand-in implements /api/v0/add (a single part multipart upload, answered with the CIDv0 of the
+# part) and /api/v0/pin/add, and answers every --fail-every-th upload with a 503 after reading it,
+# so the client retries. Fails if a file isn't pinned, or if the client's sent and retried byte
+# counts differ from the file bytes the stand-in saw in accepted and rejected uploads.
+# Before pinning, checks ipfs_multihash on multi-chunk files against CIDs from `ipfs add --only-hash`.
+
+read_size = 262144
+
+# (name, size, CID) of files holding hashlib.shake_256(name).digest(size), hashed once with
+# `ipfs add --only-hash` of kubo 0.22.0 at its defaults
+known_answers = [
+  # 13 leaves under one root
+  ("few_mib", 3 * 1048576 + 12345, "QmSHk6Xr1Tdcs9PgsT49HVuAAX1xK2puyn54HU2TfDdAVY"),
+  # exactly max_links leaves, the largest single level tree
+  ("one_level_full", max_links * chunk_size, "QmYuCKuXdS2rYEznWT2t39qA39tiD8FAdz6hn2MskcQBqN"),
+  # 177 leaves, a root over a full parent and a parent of 3
+  ("two_levels", (max_links + 2) * chunk_size + 1000, "QmVhxwTbqo9sduqpdeyxChf93mQ2KAfWLyx7BLFyzFX1Qv"),
+]
+
+def check_known_answers(work_dir):
+  # messages for every known answer get_ipfs_multihash, or a hasher fed uneven pieces, gets wrong
+  problems = []
+  for name, size, expected in known_answers:
+    data = hashlib.shake_256(name.encode()).digest(size)
+    file_path = os.path.join(work_dir, name)
+    with open(file_path, 'wb') as f:
+      f.write(data)
+    hasher = UnixfsHasher()
+    for i in range(0, size, 100003):
+      hasher.update(data[i:i + 100003])
+    for label, actual in [("get_ipfs_multihash", get_ipfs_multihash(file_path)), ("UnixfsHasher", hasher.multihash())]:
+      if actual != expected:
+        problems.append("{} of {} ({} bytes) is {}, ipfs says {}".format(label, name, size, actual, expected))
+    os.remove(file_path)
+  return problems
+
+class IpfsApiStandIn:
+  def __init__(self, fail_every=0):
+    self.fail_every = fail_every
+    self.lock = threading.Lock()
+    self.uploads = 0
+    self.added = set()
+    self.pinned = set()
+    self.accepted_bytes = 0
+    self.rejected_bytes = 0
+    stand_in = self
+
+    class Handler(BaseHTTPRequestHandler):
+      protocol_version = "HTTP/1.1"
+
+      def log_message(self, *args):
+        pass
+
+      def reply(self, status, document):
+        data = (json.dumps(document) + "\n").encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+      def do_POST(self):
+        url = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        length = int(self.headers.get("Content-Length", 0))
+        if url.path == "/api/v0/add":
+          multihash, size = stand_in.read_upload(self.rfile, length, self.headers.get("Content-Type", ""))
+          with stand_in.lock:
+            stand_in.uploads += 1
+            fail = stand_in.fail_every and stand_in.uploads % stand_in.fail_every == 0
+            if fail:
+              stand_in.rejected_bytes += size
+            else:
+              stand_in.accepted_bytes += size
+              stand_in.added.add(multihash)
+          if fail:
+            self.reply(503, {"Message": "stand-in failure", "Code": 0})
+          else:
+            self.reply(200, {"Name": "file", "Hash": multihash, "Size": str(size)})
+        elif url.path == "/api/v0/pin/add":
+          self.rfile.read(length)
+          multihash = query.get("arg", [""])[0]
+          with stand_in.lock:
+            known = multihash in stand_in.added
+            if known:
+              stand_in.pinned.add(multihash)
+          if known:
+            self.reply(200, {"Pins": [multihash]})
+          else:
+            self.reply(500, {"Message": "{} was never added".format(multihash), "Code": 0})
+        else:
+          self.rfile.read(length)
+          self.reply(404, {"Message": "no such endpoint", "Code": 0})
+
+    self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    self.server.daemon_threads = True
+    self.url = "http://127.0.0.1:{}".format(self.server.server_address[1])
+    self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+    self.thread.start()
+
+  def read_upload(self, rfile, length, content_type):
+    # (multihash, size) of the single file part of a multipart/form-data body, hashed as it streams in
+    boundary = content_type.split("boundary=")[-1].encode()
+    tail = "\r\n--{}--\r\n".format(boundary.decode()).encode()
+    head = b""
+    remaining = length
+    while b"\r\n\r\n" not in head:
+      data = rfile.read(min(1024, remaining))
+      if not data:
+        raise ValueError("Truncated multipart head")
+      remaining -= len(data)
+      head += data
+    if not head.startswith(b"--" + boundary):
+      raise ValueError("Multipart body doesn't start with its boundary")
+    data = head[head.index(b"\r\n\r\n") + 4:]
+    hasher = UnixfsHasher()
+    # everything but the last len(tail) bytes is file content
+    pending = bytearray(data)
+    while remaining:
+      data = rfile.read(min(read_size, remaining))
+      if not data:
+        raise ValueError("Truncated multipart body")
+      remaining -= len(data)
+      pending += data
+      if len(pending) > len(tail):
+        hasher.update(bytes(pending[:-len(tail)]))
+        del pending[:-len(tail)]
+    if bytes(pending) != tail:
+      raise ValueError("Multipart body doesn't end with its boundary")
+    return hasher.multihash(), hasher.size
+
+  def close(self):
+    self.server.shutdown()
+    self.server.server_close()
+
+def main():
+  parser = argparse.ArgumentParser(description="Check PinClient's throughput and byte accounting against a local IPFS API stand-in")
+  parser.add_argument("--files", type=int, default=200, help="number of files to pin")
+  parser.add_argument("--file-bytes", type=int, default=400000, help="size of every file, about a card_low.jpg")
+  parser.add_argument("--concurrency", type=int, default=4, help="PinClient workers")
+  parser.add_argument("--fail-every", type=int, default=7, help="answer every n-th upload with a 503, 0 for never")
+  args = parser.parse_args()
+
+  work_dir = tempfile.mkdtemp(prefix="pin_benchmark_")
+  stand_in = IpfsApiStandIn(args.fail_every)
+  client = PinClient(stand_in.url, concurrency=args.concurrency, retries=3, backoff=0)
+  try:
+    problems = check_known_answers(work_dir)
+    print("{} of {} known answer CIDs match".format(len(known_answers) - len(problems), len(known_answers)))
+    candidates = []
+    for i in range(args.files):
+      file_path = os.path.join(work_dir, "{:06d}.jpg".format(i))
+      with open(file_path, 'wb') as f:
+        f.write(os.urandom(args.file_bytes))
+      candidates.append((get_ipfs_multihash(file_path), file_path))
+
+    start = time.perf_counter()
+    pinned, errors = client.pin_all(candidates)
+    seconds = time.perf_counter() - start
+  finally:
+    client.close()
+    stand_in.close()
+    shutil.rmtree(work_dir)
+
+  print(client.summary())
+  print("{} files of {} bytes in {:.2f}s, {:.1f} files/s, {:.2f} MB/s".format(
+    args.files, args.file_bytes, seconds, args.files / seconds, client.bytes_sent / 1e6 / seconds))
+  for problem in problems:
+    print(problem)
+  failed = bool(problems)
+  expected = set(c[0] for c in candidates)
+  if errors or set(pinned) != expected or stand_in.pinned != expected:
+    print("{} of {} files pinned, {} errors".format(len(stand_in.pinned & expected), len(expected), len(errors)))
+    failed = True
+  if client.bytes_sent != stand_in.accepted_bytes or client.bytes_sent != args.files * args.file_bytes:
+    print("client counted {} bytes sent, the stand-in accepted {} of {} file bytes".format(
+      client.bytes_sent, stand_in.accepted_bytes, args.files * args.file_bytes))
+    failed = True
+  if client.bytes_retried != stand_in.rejected_bytes:
+    print("client counted {} bytes retried, the stand-in rejected {}".format(client.bytes_retried, stand_in.rejected_bytes))
+    failed = True
+  if failed:
+    sys.exit(1)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,90 @@
+import gc
+import os
+import sys
+import time
+import argparse
+
+script_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(script_dir, "../src"))
+
+from postgres_text import encode_array
+
+# Benchmark and correctness check for the Postgres array encoder used by generate_database.py.
+# Encodes resource_urls style arrays for a large remote_resource table with encode_array and with
+# the concatenation based encoder it replaced, and fails if encode_array is wrong or more than --max-ratio times slower than it.
+
+# value: expected literal, as Postgres itself would print it
+cases = [
+  (["https://example.com/a.jpg", "ipfs://QmNyRwaniWvu1mb9XiYeFWAst6857EQgy2ZuM5nwg6xjfq"], '{https://example.com/a.jpg,ipfs://QmNyRwaniWvu1mb9XiYeFWAst6857EQgy2ZuM5nwg6xjfq}'),
+  (["Collectible Character"], '{"Collectible Character"}'),
+  (["a,b", "{c}", 'd"e', "f\\g"], '{"a,b","{c}","d\\"e","f\\\\g"}'),
+  (["", "NULL", "null", "nUlL", None, float("nan")], '{"","NULL","null","nUlL",NULL,NULL}'),
+  (["a", "nul", "nulls"], '{a,nul,nulls}'),
+  ([["a", "b"], ["c", None]], '{{a,b},{c,NULL}}'),
+  ([1, 2.5], '{1,2.5}'),
+  ([], '{}'),
+]
+
+def concat_encoder(l):
+  # the encoder replaced by postgres_text.encode_array, kept as the baseline
+  if not l:
+    return ''
+  text = '{'
+  for i in range(len(l)):
+    text += str(l[i])
+    if i < len(l) - 1:
+      text += ','
+  text += '}'
+  return text
+
+def resource_urls(n):
+  return [[
+    "https://api.rektangularstudios.com/static/{:012d}/resource/card_low.jpg".format(i),
+    "ipfs://QmNyRwaniWvu1mb9XiYeFWAst6857EQgy2ZuM5nwg6xjfq",
+    "sia://PAFMGeI8LnPf4a59iC_5Zpmbjmp-dxG0lNd2MDLpLqHUsA",
+  ] for i in range(n)]
+
+def time_encoder(encoder, rows):
+  # with the garbage collector off like timeit, its pauses land on whichever encoder runs when they come
+  gc.collect()
+  gc.disable()
+  try:
+    start = time.perf_counter()
+    for row in rows:
+      encoder(row)
+    return time.perf_counter() - start
+  finally:
+    gc.enable()
+
+def main():
+  parser = argparse.ArgumentParser(description="Check the Postgres array encoder for correctness and speed")
+  parser.add_argument("--rows", type=int, default=600000, help="arrays to encode, six resources per product")
+  parser.add_argument("--max-ratio", type=float, default=1.5, help="allowed encode_array time relative to the concatenation baseline")
+  parser.add_argument("--repeat", type=int, default=5, help="time each encoder this many times and keep the fastest")
+  args = parser.parse_args()
+
+  failed = False
+  for value, expected in cases:
+    actual = encode_array(value)
+    if actual != expected:
+      print("encode_array({!r}) = {} != {}".format(value, actual, expected))
+      failed = True
+
+  # best of interleaved runs, so a slow moment of the machine doesn't fail the comparison
+  rows = resource_urls(args.rows)
+  baseline = encoded = float("inf")
+  for _ in range(args.repeat):
+    baseline = min(baseline, time_encoder(concat_encoder, rows))
+    encoded = min(encoded, time_encoder(encode_array, rows))
+  print("{:>16}: {:7.3f}s, {:5.2f}us per array".format("concatenation", baseline, 1e6 * baseline / args.rows))
+  print("{:>16}: {:7.3f}s, {:5.2f}us per array".format("encode_array", encoded, 1e6 * encoded / args.rows))
+  ratio = encoded / baseline
+  print("encode_array / concatenation: {:.2f}".format(ratio))
+  if ratio > args.max_ratio:
+    print("encode_array is {:.2f} times slower than the baseline > {}".format(ratio, args.max_ratio))
+    failed = True
+  if failed:
+    sys.exit(1)
+
+if __name__ == "__main__":
+  main()
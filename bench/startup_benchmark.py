@@ -0,0 +1,67 @@
+import os
+import sys
+import time
+import argparse
+import subprocess
+import statistics
+
+script_dir = os.path.dirname(os.path.realpath(__file__))
+src_dir = os.path.join(script_dir, "../src")
+
+# Startup regression benchmark for the small entry points run from CI hooks.
+# Times `python <script> --help` (imports plus argument parsing, no work) and fails if a script
+# got slower than --max-ms or if importing it pulls in a heavy module it shouldn't need at startup.
+
+scripts = [
+  "generate_folders.py",
+  "bundle_metadata.py",
+  "validate_resources.py",
+  "construct_static.py",
+  "pipeline.py",
+]
+
+# modules none of the scripts above may import before doing any work
+heavy_modules = ["pandas", "numpy", "requests", "PIL", "yaml"]
+
+def time_startup(script, runs):
+  timings = []
+  for _ in range(runs):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, script, "--help"], cwd=src_dir, stdout=subprocess.DEVNULL, check=True)
+    timings.append(time.perf_counter() - start)
+  return statistics.median(timings)
+
+def heavy_imports(script):
+  module = os.path.splitext(script)[0]
+  code = "import sys, {}; print(' '.join(m for m in {!r} if m in sys.modules))".format(module, heavy_modules)
+  result = subprocess.run([sys.executable, "-c", code], cwd=src_dir, capture_output=True, text=True, check=True)
+  return result.stdout.split()
+
+def main():
+  parser = argparse.ArgumentParser(description="Check the startup time and imports of the lightweight entry points")
+  parser.add_argument("--runs", type=int, default=5, help="runs per script, the median is reported")
+  parser.add_argument("--max-ms", type=float, default=300, help="allowed median startup time per script")
+  args = parser.parse_args()
+
+  start = time.perf_counter()
+  for _ in range(args.runs):
+    subprocess.run([sys.executable, "-c", "pass"], check=True)
+  interpreter = (time.perf_counter() - start) / args.runs
+  print("{:>24}: {:7.1f}ms".format("bare interpreter", 1e3 * interpreter))
+
+  failed = False
+  for script in scripts:
+    seconds = time_startup(script, args.runs)
+    heavy = heavy_imports(script)
+    print("{:>24}: {:7.1f}ms{}".format(script, 1e3 * seconds, "  imports {}".format(", ".join(heavy)) if heavy else ""))
+    if 1e3 * seconds > args.max_ms:
+      print("{} starts in {:.1f}ms > {}ms".format(script, 1e3 * seconds, args.max_ms))
+      failed = True
+    if heavy:
+      print("{} imports {} at startup".format(script, ", ".join(heavy)))
+      failed = True
+  if failed:
+    sys.exit(1)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,90 @@
+import os
+import sys
+import time
+import argparse
+
+script_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(script_dir, "../src"))
+
+from table_builder import TableBuilder
+
+# Regression benchmark for the generate_database.py row builders.
+# Builds a product table and a remote_resource table (six rows per product) at increasing
+# catalog sizes and fails if the cost per product grows with the catalog, i.e. scaling is no longer linear.
+
+product_columns = [
+  'product_id',
+  'product_name',
+  'organization_id',
+  'market_id',
+  'price_currency_id',
+  'price_unit_amount',
+  'max_order_size',
+  'date_listed',
+  'date_available',
+  'native_token_id',
+]
+remote_resource_columns = [
+  'product_id',
+  'resource_id',
+  'resource_description',
+  'priority',
+  'multihash',
+  'hash_source_type',
+  'resource_urls',
+  'content_type',
+]
+
+def build_tables(n):
+  product_table = TableBuilder(product_columns)
+  remote_resource_table = TableBuilder(remote_resource_columns)
+  for i in range(n):
+    product_id = "PROD-{:026d}".format(i)
+    product_table.append({
+      'product_id': product_id,
+      'product_name': "Character {}".format(i),
+      'organization_id': 'ORG-01F45PHP58QWYSWJPFC0RYYGJ2',
+      'market_id': 'MKT-01F45PJXRNEM8V7CP48NR39639',
+      'price_currency_id': 'ada',
+      'price_unit_amount': 8,
+      'max_order_size': 5,
+      'date_listed': '2021-05-03T14:00:00-08:00',
+      'date_available': '2021-05-21T23:59:00-08:00',
+      'native_token_id': "policy.Character{}".format(i),
+    })
+    for priority in range(6):
+      remote_resource_table.append({
+        'product_id': product_id,
+        'resource_id': 'Card',
+        'resource_description': 'Low Resolution Card',
+        'priority': priority,
+        'multihash': 'QmNyRwaniWvu1mb9XiYeFWAst6857EQgy2ZuM5nwg6xjfq',
+        'hash_source_type': 'ipfs',
+        'resource_urls': '{https://example.com/card_low.jpg,ipfs://QmNyRwaniWvu1mb9XiYeFWAst6857EQgy2ZuM5nwg6xjfq}',
+        'content_type': 'image/jpeg',
+      })
+  return product_table.to_df(), remote_resource_table.to_df()
+
+def main():
+  parser = argparse.ArgumentParser(description="Check that table building scales linearly with catalog size")
+  parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+  parser.add_argument("--max-ratio", type=float, default=3.0, help="allowed growth of the per product cost between the smallest and largest size")
+  args = parser.parse_args()
+
+  per_product = []
+  for n in args.sizes:
+    start = time.perf_counter()
+    product_df, remote_resource_df = build_tables(n)
+    elapsed = time.perf_counter() - start
+    assert len(product_df) == n and len(remote_resource_df) == 6 * n
+    per_product.append(elapsed / n)
+    print("{:>8} products: {:8.3f}s, {:6.2f}us per product".format(n, elapsed, 1e6 * elapsed / n))
+
+  ratio = per_product[-1] / per_product[0]
+  print("per product cost ratio {}/{}: {:.2f}".format(args.sizes[-1], args.sizes[0], ratio))
+  if ratio > args.max_ratio:
+    print("Scaling is no longer linear: ratio {:.2f} > {}".format(ratio, args.max_ratio))
+    sys.exit(1)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,124 @@
+import os
+import errno
+import shutil
+from ipfs_multihash import get_ipfs_multihash
+
+script_dir = os.path.dirname(os.path.realpath(__file__))
+store_dir = os.path.join(script_dir, "../cas")
+
+# Linux FICLONE ioctl, clones the extents of one file into another on btrfs/xfs
+ficlone = 0x40049409
+
+link_modes = ["auto", "hardlink", "reflink", "symlink", "copy"]
+
+def reflink(src, dst):
+  import fcntl
+  with open(src, 'rb') as s, open(dst, 'wb') as d:
+    fcntl.ioctl(d.fileno(), ficlone, s.fileno())
+
+# Content addressed store of every asset, keyed by IPFS multihash.
+# The static trees are materialized from it as hardlinks, reflinks or symlinks (in that order
+# of preference in auto mode), so identical bytes are stored once however many mirrors hold them.
+# Objects are shared with every tree linking them, edit assets by replacing files, never in place.
+# Originals in static/ are hardlinked into the store too, every build step writes them through
+# build_manifest.write_if_changed, which replaces the file, so a rebuild never touches an object.
+# Every object is checked against its multihash before it's linked out.
+class AssetStore:
+  def __init__(self, root=store_dir, link_mode="auto", hash_cache=None):
+    if link_mode not in link_modes:
+      raise ValueError("Unknown link mode {}, expected one of {}".format(link_mode, link_modes))
+    self.root = root
+    self.link_mode = link_mode
+    self.hash_cache = hash_cache
+    self.links = {mode: 0 for mode in link_modes if mode != "auto"}
+    # objects known to hold their multihash's bytes in this run
+    self.verified = set()
+    self.removed = 0
+    os.makedirs(root, exist_ok=True)
+
+  def path(self, multihash):
+    # shard on the last two characters, the CIDv0 prefix is always "Qm"
+    return os.path.join(self.root, multihash[-2:], multihash)
+
+  def __contains__(self, multihash):
+    # existence only, call verify() before trusting the object's bytes
+    return multihash is not None and os.path.isfile(self.path(multihash))
+
+  def verify(self, multihash):
+    # whether the store holds multihash, an object whose bytes don't match it is removed
+    # so it's fetched again instead of being linked into more trees
+    if multihash in self.verified:
+      return True
+    object_path = self.path(multihash)
+    if not os.path.isfile(object_path):
+      return False
+    # the hash cache rehashes whenever the object's size, mtime or inode changed
+    if self.hash_cache is not None:
+      m = self.hash_cache.get_multihash(object_path)
+    else:
+      m = get_ipfs_multihash(object_path)
+    if m != multihash:
+      print("Warning: asset store object {} holds {}, removing it".format(multihash, m))
+      os.remove(object_path)
+      self.removed += 1
+      return False
+    self.verified.add(multihash)
+    return True
+
+  def add(self, file_path, multihash, share=True):
+    # store file_path under its (already verified) multihash, sharing its inode with the object
+    # where possible. With share a mirror copy is replaced by a link to the object when the store
+    # already holds the bytes, without it (originals in static/) the file is left as it is.
+    object_path = self.path(multihash)
+    if self.verify(multihash):
+      if share and not os.path.samefile(object_path, file_path):
+        self.materialize(multihash, file_path)
+      return object_path
+    os.makedirs(os.path.dirname(object_path), exist_ok=True)
+    tmp_path = object_path + ".tmp"
+    if os.path.lexists(tmp_path):
+      os.remove(tmp_path)
+    try:
+      os.link(file_path, tmp_path)
+    except OSError:
+      shutil.copyfile(file_path, tmp_path)
+    os.replace(tmp_path, object_path)
+    self.verified.add(multihash)
+    return object_path
+
+  def materialize(self, multihash, dest):
+    # place the stored object at dest without copying its bytes when the filesystem allows it
+    object_path = self.path(multihash)
+    if not self.verify(multihash):
+      raise ValueError("Multihash {} is not in the asset store {}".format(multihash, self.root))
+    tmp_path = dest + ".link"
+    if os.path.lexists(tmp_path):
+      os.remove(tmp_path)
+
+    modes = ["hardlink", "reflink", "symlink"] if self.link_mode == "auto" else [self.link_mode]
+    for mode in modes:
+      try:
+        if mode == "hardlink":
+          os.link(object_path, tmp_path)
+        elif mode == "reflink":
+          reflink(object_path, tmp_path)
+        elif mode == "symlink":
+          os.symlink(os.path.relpath(object_path, os.path.dirname(dest)), tmp_path)
+        else:
+          shutil.copyfile(object_path, tmp_path)
+      except (OSError, ImportError) as e:
+        if os.path.lexists(tmp_path):
+          os.remove(tmp_path)
+        if self.link_mode != "auto" or mode == modes[-1]:
+          raise
+        # e.g. EXDEV across filesystems or EOPNOTSUPP for reflinks, try the next mode
+        if isinstance(e, OSError) and e.errno not in (errno.EXDEV, errno.EPERM, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.EMLINK):
+          raise
+        continue
+      os.replace(tmp_path, dest)
+      self.links[mode] += 1
+      return mode
+
+  def summary(self):
+    return "materialized {}, removed {} corrupt objects".format(
+      ", ".join("{}: {}".format(mode, n) for mode, n in self.links.items()), self.removed)
@@ -0,0 +1,72 @@
+import os
+import json
+import hashlib
+
+script_dir = os.path.dirname(os.path.realpath(__file__))
+cache_dir = os.path.join(script_dir, "../cache")
+manifest_json = os.path.join(cache_dir, "build_manifest.json")
+
+# bump when the generated nvla.json / onchain.json layout changes so every product is rebuilt
+manifest_version = 2
+
+def fingerprint(inputs):
+  # stable digest of any JSON-like structure, values pandas/numpy hand us are stringified
+  encoded = json.dumps(inputs, sort_keys=True, default=str).encode('utf-8')
+  return hashlib.sha256(encoded).hexdigest()
+
+def write_if_changed(path, text):
+  # skip the write when the file already holds these exact bytes, which keeps its mtime
+  # (and so its hash cache entry) intact and avoids touching files that would be re-pinned,
+  # text is written as UTF-8 and bytes as is. The new bytes go to a temporary file that replaces
+  # the old one, so hardlinks to the old file keep their bytes and a crash never leaves half a file
+  data = text.encode('utf-8') if isinstance(text, str) else text
+  try:
+    with open(path, 'rb') as f:
+      if f.read() == data:
+        return False
+  except FileNotFoundError:
+    pass
+  tmp_path = "{}.{}.tmp".format(path, os.getpid())
+  try:
+    with open(tmp_path, 'wb') as f:
+      f.write(data)
+    os.replace(tmp_path, path)
+  except BaseException:
+    if os.path.lexists(tmp_path):
+      os.remove(tmp_path)
+    raise
+  return True
+
+# Records the input fingerprint and output multihashes of every generated product,
+# so an incremental build can skip products whose inputs and outputs are unchanged.
+class BuildManifest:
+  def __init__(self, path=manifest_json):
+    self.path = path
+    self.products = {}
+    try:
+      with open(path, 'r') as f:
+        manifest = json.load(f)
+      if manifest.get("version") == manifest_version:
+        self.products = manifest["products"]
+    except FileNotFoundError:
+      pass
+
+  def is_current(self, product_id, input_fingerprint, output_paths, hash_cache):
+    entry = self.products.get(product_id)
+    if entry is None or entry["fingerprint"] != input_fingerprint:
+      return False
+    # outputs edited or deleted by hand since the last build are regenerated
+    for name, path in output_paths.items():
+      if not os.path.isfile(path) or hash_cache.get_multihash(path) != entry["outputs"].get(name):
+        return False
+    return True
+
+  def record(self, product_id, input_fingerprint, outputs):
+    self.products[product_id] = {
+      "fingerprint": input_fingerprint,
+      "outputs": outputs,
+    }
+
+  def save(self):
+    os.makedirs(os.path.dirname(self.path), exist_ok=True)
+    write_if_changed(self.path, json.dumps({"version": manifest_version, "products": self.products}, indent=2, sort_keys=True))
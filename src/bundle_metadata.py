@@ -1,45 +1,97 @@
 import os
-import pandas as pd
-from shutil import copyfile
 import json
-import yaml
+import argparse
+import tx_metadata
+from build_manifest import write_if_changed
+from project import add_project_arguments, project_from_args
 
-script_dir = os.path.dirname(os.path.realpath(__file__))
-static_dir = os.path.join(script_dir, "../static")
+# --batch packs the assets into metadata/batch_NNNN.json instead, each one mint transaction, and
+# lists them in metadata/batches.json. The batch files are rewritten as a whole on every run.
+# They follow CIP-25, --compact is refused with --batch until compact metadata does too.
+batch_index_name = "batches.json"
 
-index_dir = os.path.join(script_dir, "../index")
-static_csv = os.path.join(index_dir, "index.csv")
+def add_arguments(parser):
+  parser.add_argument("--batch", action="store_true", help="pack the assets into as few mint transactions as fit, in metadata/batch_NNNN.json")
+  parser.add_argument("--compact", action="store_true", help="not supported with --batch, compact metadata isn't CIP-25, see tx_metadata.py for what it would save")
+  parser.add_argument("--max-tx-bytes", type=int, default=tx_metadata.max_tx_bytes, help="maximum transaction size in bytes")
+  parser.add_argument("--tx-overhead", type=int, default=tx_metadata.tx_overhead_bytes,
+    help="bytes of a mint transaction besides metadata and minted values, i.e. inputs, outputs, fee, policy script and witnesses")
 
-metadata_dir = os.path.join(script_dir, "../metadata")
+def run(project, args):
+  if args.batch and args.compact:
+    raise ValueError("--compact can't be used with --batch, compact metadata doesn't follow CIP-25 and would mint assets without their shared fields")
+  if args.batch:
+    bundle_batches(project, args.max_tx_bytes - args.tx_overhead)
+  else:
+    bundle(project)
 
-config_dir = os.path.join(script_dir, "../config")
-cfg_yaml = os.path.join(config_dir, "config.yaml")
+def bundle(project):
+  # copy each product's on-chain metadata to metadata/<asset_id>.json for minting
+  cfg = project.cfg
+  os.makedirs(project.metadata_dir, exist_ok=True)
 
-def main():
-  with open(cfg_yaml, 'r') as cfg_file:
-    cfg = yaml.full_load(cfg_file)
-
-  # read static serving index
-  print("reading static serving index from {}".format(static_csv))
-  static_df = pd.read_csv(static_csv)
-  print(static_df.head())
-
-  for _, row in static_df.iterrows():
+  for row in project.static_index:
+    project.profiler.product(row["nanoid"])
     print("Checking {}".format(row["name"]))
 
-    # load "onchain metadata"
-    try:
-      with open(os.path.join(static_dir, row["nanoid"], "onchain.json"), 'r') as f:
-        onchain = json.load(f)
-    except:
+    # load "onchain metadata", from memory if build just produced it
+    onchain = project.artifact(row["nanoid"], "onchain.json")
+    if onchain is None:
       print("Missing onchain.json, skipping")
       continue
 
     asset_id = list(onchain["721"][cfg["policy_id"]])[0]
 
-    in_path = os.path.join(static_dir, row["nanoid"], "onchain.json")
-    out_path = os.path.join(metadata_dir, "{}.json".format(asset_id))
-    copyfile(in_path, out_path)
+    out_path = os.path.join(project.metadata_dir, "{}.json".format(asset_id))
+    write_if_changed(out_path, json.dumps(onchain, indent=2))
+
+def bundle_batches(project, max_bytes):
+  # pack the on-chain metadata of all products into metadata/batch_NNNN.json, one per mint transaction
+  os.makedirs(project.metadata_dir, exist_ok=True)
+
+  documents = []
+  for row in project.static_index:
+    onchain = project.artifact(row["nanoid"], "onchain.json")
+    if onchain is None:
+      print("Missing onchain.json of {}, skipping".format(row["name"]))
+      continue
+    documents.append(onchain)
+  batches = tx_metadata.pack(documents, max_bytes)
+
+  index = []
+  for i, (document, asset_ids) in enumerate(batches):
+    project.profiler.product("batch_{:04d}".format(i + 1))
+    name = "batch_{:04d}.json".format(i + 1)
+    write_if_changed(os.path.join(project.metadata_dir, name), json.dumps(document, indent=2))
+    index.append({
+      "file": name,
+      "assets": asset_ids,
+      "metadata_bytes": len(tx_metadata.encode_metadata(document)),
+    })
+  project.profiler.product(None)
+
+  # batches of a previous run with more assets
+  names = set(entry["file"] for entry in index)
+  for name in os.listdir(project.metadata_dir):
+    if name.startswith("batch_") and name.endswith(".json") and name not in names:
+      os.remove(os.path.join(project.metadata_dir, name))
+  write_if_changed(os.path.join(project.metadata_dir, batch_index_name), json.dumps(index, indent=2))
+
+  n = sum(len(entry["assets"]) for entry in index)
+  total = sum(entry["metadata_bytes"] for entry in index)
+  print("packed {} assets into {} mint transactions, {} metadata bytes, at most {} bytes each with their minted values".format(
+    n, len(index), total, max_bytes))
+
+def main():
+  parser = argparse.ArgumentParser(description="Copy the on-chain metadata of every product to metadata/")
+  add_project_arguments(parser)
+  add_arguments(parser)
+  args = parser.parse_args()
+  project = project_from_args(args)
+  try:
+    run(project, args)
+  finally:
+    project.close()
 
 if __name__ == "__main__":
   main()
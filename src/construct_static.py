@@ -1,30 +1,17 @@
 import os
 import re
-import pandas as pd
-import json
-import urllib.request
-import subprocess
-import yaml
+import argparse
+from project import add_project_arguments, project_from_args
+from fetch import Fetcher, DownloadJournal, default_concurrency
+from asset_store import AssetStore, link_modes
 
-script_dir = os.path.dirname(os.path.realpath(__file__))
-static_dir = os.path.join(script_dir, "../static")
+sia_portal = "https://siasky.net/"
+ipfs_gateway = "https://api.rektangularstudios.com/ipfs/"
 
-ipfs_static_dir = os.path.join(script_dir, "..", "constructed_ipfs_static")
-sia_static_dir = os.path.join(script_dir, "..", "constructed_sia_static")
-cdn_static_dir = os.path.join(script_dir, "..", "constructed_cdn_static")
-
-index_dir = os.path.join(script_dir, "../index")
-static_csv = os.path.join(index_dir, "index.csv")
-
-config_dir = os.path.join(script_dir, "../config")
-cfg_yaml = os.path.join(config_dir, "config.yaml")
-
-def translateDecentralizedUrl(url):
+def translateDecentralizedUrl(url, siaPortal=sia_portal, ipfsGateway=ipfs_gateway):
     siaPrefix = "sia://"
-    siaPortal = "https://siasky.net/"
 
     ipfsPrefix = "ipfs://"
-    ipfsGateway = "https://api.rektangularstudios.com/ipfs/"
 
     httpPattern = "https?:\\/\\/(www\\.)?[-a-zA-Z0-9@:%._\\+~#=]{1,256}\\.[a-zA-Z0-9()]{1,6}\\b([-a-zA-Z0-9()@:%_\\+.~#?&//=]*)"
 
@@ -36,11 +23,9 @@ def translateDecentralizedUrl(url):
       return [url, "cdn"]
     return ["https://" + url, "cdn"]
 
-def get_ipfs_multihash(file_path):
-  # requires that script caller has IPFS installed
-  # ipfs add file_path --only-hash -q
-  result = subprocess.run(['ipfs', 'add', file_path, '--only-hash', '-q'], stdout=subprocess.PIPE)
-  return result.stdout.decode('utf-8').strip()
+def join_chunks(value):
+  # a string of the on-chain metadata, which is a list of chunks when it is over 64 bytes
+  return "".join(value) if isinstance(value, list) else value
 
 def get_filename_from_resource(r):
   names = {
@@ -51,40 +36,97 @@ def get_filename_from_resource(r):
   }
   return names[r["resource_id"]][r["priority"]]
 
+def add_arguments(parser):
+  for k in default_concurrency:
+    parser.add_argument("--{}-concurrency".format(k), type=int, default=default_concurrency[k], help="concurrent downloads from {}".format(k))
+  parser.add_argument("--retries", type=int, default=3, help="retries per download, with exponential backoff")
+  parser.add_argument("--timeout", type=float, default=60, help="socket timeout in seconds")
+  parser.add_argument("--ipfs-gateway", default=ipfs_gateway, help="gateway used for ipfs:// URLs")
+  parser.add_argument("--sia-portal", default=sia_portal, help="portal used for sia:// URLs")
+  parser.add_argument("--max-bytes", type=int, help="abort any download larger than this many bytes")
+  parser.add_argument("--static-host", help="serve CDN URLs from this host instead of static_host in config.yaml")
+  parser.add_argument("--resume", action="store_true", help="continue the previous run from its journal instead of starting a new one")
+  parser.add_argument("--link-mode", choices=link_modes, default="auto", help="how mirror files are materialized from the asset store")
+  parser.add_argument("--fetch-known", action="store_true", help="download content even if the asset store already holds it, to check every backend serves it")
+
+def run(project, args):
+  concurrency = {k: getattr(args, "{}_concurrency".format(k)) for k in default_concurrency}
+  journal = DownloadJournal(os.path.join(project.cache_dir, "mirror_journal.jsonl"), resume=args.resume)
+  if args.resume:
+    print("resuming previous run, {}".format(journal.progress()))
+  fetcher = Fetcher(concurrency=concurrency, retries=args.retries, timeout=args.timeout, journal=journal)
+  store = AssetStore(project.cas_dir, link_mode=args.link_mode, hash_cache=project.hash_cache)
+  try:
+    construct(project, fetcher, store,
+      ipfs_gateway=args.ipfs_gateway,
+      sia_portal=args.sia_portal,
+      static_host=args.static_host,
+      max_bytes=args.max_bytes,
+      fetch_known=args.fetch_known)
+  finally:
+    fetcher.close()
+    print(journal.progress())
+    journal.close()
+  print(fetcher.summary())
+  print(store.summary())
+
 def main():
-  with open(cfg_yaml, 'r') as cfg_file:
-    cfg = yaml.full_load(cfg_file)
+  parser = argparse.ArgumentParser(description="Mirror and verify every resource from the CDN, IPFS and Sia")
+  add_project_arguments(parser)
+  add_arguments(parser)
+  args = parser.parse_args()
+  project = project_from_args(args)
+  try:
+    run(project, args)
+  finally:
+    project.close()
+
+def construct(project, fetcher, store, ipfs_gateway=ipfs_gateway, sia_portal=sia_portal, static_host=None, max_bytes=None, fetch_known=False):
+  cfg = project.cfg
+  hash_cache = project.hash_cache
+
+  def translate(u):
+    url, t = translateDecentralizedUrl(u, sia_portal, ipfs_gateway)
+    if t == "cdn" and static_host:
+      url = url.replace(cfg["static_host"], static_host, 1)
+    return url, t
 
   # read static serving index
-  print("reading static serving index from {}".format(static_csv))
-  static_df = pd.read_csv(static_csv)
-  print(static_df.head())
-
-  dirs = {
-    "cdn": cdn_static_dir,
-    "ipfs": ipfs_static_dir,
-    "sia": sia_static_dir,
-  }
+  static_index = project.static_index
+
+  dirs = project.mirror_dirs
 
   # make root directories
   for k in dirs:
     if not os.path.isdir(dirs[k]):
       os.mkdir(dirs[k])
 
-  for _, row in static_df.iterrows():
+  # (url, backend, file_path, multihash) to fetch, downloads are verified while they stream in
+  # (url, backend, label, file_path, multihash) of files already on disk, verified through the hash cache
+  downloads = {}
+  verifications = []
+  # (file_path, multihash) of originals in static/, added to the asset store once verified
+  originals = []
+
+  def plan(url, backend, file_path, multihash=None, label=None):
+    if os.path.exists(file_path):
+      if multihash is not None:
+        verifications.append((url, backend, label, file_path, multihash))
+    elif file_path not in downloads:
+      downloads[file_path] = (url, backend, file_path, multihash)
+
+  for row in static_index:
+    project.profiler.product(row["nanoid"])
     print("Checking {}".format(row["name"]))
 
     # make character subdirectory
+    product_dirs = {k: project.product_dir(row["nanoid"], dirs[k]) for k in dirs}
     for k in dirs:
-      p = os.path.join(dirs[k], row["nanoid"])
-      if not os.path.isdir(p):
-        os.mkdir(p)
-
-    # load "onchain metadata"
-    try:
-      with open(os.path.join(static_dir, row["nanoid"], "onchain.json"), 'r') as f:
-        onchain = json.load(f)
-    except:
+      os.makedirs(product_dirs[k], exist_ok=True)
+
+    # load "onchain metadata", from memory if build just produced it
+    onchain = project.artifact(row["nanoid"], "onchain.json")
+    if onchain is None:
       print("Missing onchain.json, skipping")
       continue
 
@@ -95,50 +137,86 @@ def main():
       raise ValueError("Didn't get Novellia resource_id")
     nvla_resource = onchain_resource[0]
 
-    # download and verify novellia resource
+    # novellia resource, URLs over 64 bytes are split into chunks on chain
     for u in nvla_resource["url"]:
-      translate = translateDecentralizedUrl(u)
-      url = translate[0]
-      t = translate[1]
-      file_path = os.path.join(dirs[t], row["nanoid"], "nvla.json")
-      if not os.path.exists(file_path):
-        urllib.request.urlretrieve(url, file_path)
-      m = get_ipfs_multihash(file_path)
-      if m != nvla_resource["multihash"]:
-        raise ValueError("({}) Bad nvla multihash, {} != {}".format(url, nvla_resource["multihash"], m))
-
-    # download thumbnail for visual sanity check
+      url, t = translate(join_chunks(u))
+      file_path = os.path.join(product_dirs[t], "nvla.json")
+      plan(url, t, file_path, nvla_resource["multihash"], "nvla")
+
+    # thumbnail for visual sanity check
+    image = join_chunks(onchain["721"][cfg["policy_id"]][asset_id]["image"])
+    image_multihash = image[len("ipfs://"):] if image.startswith("ipfs://") else None
     for k in dirs:
-      translate = translateDecentralizedUrl(onchain["721"][cfg["policy_id"]][asset_id]["image"])
-      url = translate[0]
-      t = translate[1]
-      file_path = os.path.join(dirs[k], row["nanoid"], "thumbnail.jpg")
-      if not os.path.exists(file_path):
-        urllib.request.urlretrieve(url, file_path)
+      url, t = translate(image)
+      plan(url, t, os.path.join(product_dirs[k], "thumbnail.jpg"), image_multihash, "thumbnail")
 
     # make resource subdirectory
     for k in dirs:
-      p = os.path.join(dirs[k], row["nanoid"], "resource")
-      if not os.path.isdir(p):
-        os.mkdir(p)
+      os.makedirs(os.path.join(product_dirs[k], "resource"), exist_ok=True)
 
     # load novellia resource
-    with open(os.path.join(static_dir, row["nanoid"], "nvla.json"), 'r') as f:
-      nvla = json.load(f)
+    nvla = project.artifact(row["nanoid"], "nvla.json")
+    if nvla is None:
+      raise ValueError("Missing nvla.json for {}".format(row["name"]))
+    originals.append((project.artifact_path(row["nanoid"], "nvla.json"), nvla_resource["multihash"]))
 
-    # download and verify each character resource
+    # each character resource
     for r in nvla["details"]["resource"]:
       for u in r["url"]:
-        translate = translateDecentralizedUrl(u)
-        url = translate[0]
-        t = translate[1]
+        url, t = translate(u)
         file_name = get_filename_from_resource(r)
-        file_path = os.path.join(dirs[t], row["nanoid"], "resource", file_name)
-        if not os.path.exists(file_path):
-          urllib.request.urlretrieve(url, file_path)
-        m = get_ipfs_multihash(file_path)
-        if m != r["multihash"]:
-          raise ValueError("({}) Bad resource multihash, {} != {}".format(url, r["multihash"], m))
+        file_path = os.path.join(product_dirs[t], "resource", file_name)
+        plan(url, t, file_path, r["multihash"], "resource")
+      originals.append((os.path.join(project.product_dir(row["nanoid"]), "resource", get_filename_from_resource(r)), r["multihash"]))
+
+  project.profiler.product(None)
+
+  # share the originals in static/ with the asset store
+  originals = [o for o in originals if os.path.isfile(o[0])]
+  original_multihashes = hash_cache.get_multihashes([o[0] for o in originals], jobs=project.jobs)
+  for file_path, multihash in originals:
+    if original_multihashes[file_path] == multihash:
+      store.add(file_path, multihash, share=False)
+
+  # verify files that were already mirrored, anything that doesn't match
+  # (e.g. truncated by a run that predates .part files) is fetched again
+  for url, backend, label, file_path, multihash in verifications:
+    m = hash_cache.get_multihash(file_path)
+    if m != multihash:
+      print("Warning: ({}) Bad {} multihash, {} != {}, fetching again".format(url, label, multihash, m))
+      os.remove(file_path)
+      downloads[file_path] = (url, backend, file_path, multihash)
+    else:
+      # dedupe copies mirrored before the asset store existed
+      store.add(file_path, multihash)
+      hash_cache.record(file_path, multihash)
+
+  # finish what the journal of a resumed run still has pending
+  if fetcher.journal is not None:
+    for job in fetcher.journal.pending():
+      if job[2] not in downloads and not os.path.exists(job[2]):
+        downloads[job[2]] = job
+
+  # content the asset store already holds only needs linking into place
+  if not fetch_known:
+    for file_path, (url, backend, _, multihash) in list(downloads.items()):
+      if store.verify(multihash):
+        store.materialize(multihash, file_path)
+        hash_cache.record(file_path, multihash)
+        del downloads[file_path]
+
+  # download everything else concurrently
+  print("downloading {} files".format(len(downloads)))
+  multihashes, errors = fetcher.fetch_all(list(downloads.values()), max_bytes)
+  for file_path, multihash in multihashes.items():
+    store.add(file_path, multihash)
+    hash_cache.record(file_path, multihash)
+    # downloads overlap, so each file is recorded with its own wall time rather than as a lap
+    seconds, attempts = fetcher.timings[file_path]
+    project.profiler.record(os.path.relpath(file_path, project.root), kind="file",
+      seconds=seconds, attempts=attempts, received_bytes=os.path.getsize(file_path))
+  if errors:
+    raise errors[0]
 
 if __name__ == "__main__":
   main()
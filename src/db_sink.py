@@ -0,0 +1,154 @@
+import urllib.parse
+from postgres_text import is_null
+
+# Publishes the generate_database.py tables straight into a database in one transaction.
+# Each table is bulk loaded into a temporary staging table (COPY ... FROM STDIN on Postgres)
+# and upserted into the real table on its natural key, so publishing a drop again updates it in place.
+# A sqlite:// URL runs the same staging and upsert SQL in-process, for testing without a Postgres server.
+# The upsert needs a unique constraint on the key columns of every table, the Postgres sink checks
+# for them when it connects. Blank values are published as NULL, see blanks_to_null.
+
+# table: columns identifying a row, the ON CONFLICT target of the upsert
+table_keys = {
+  "native_token": ["native_token_id"],
+  "product": ["product_id"],
+  "commission": ["product_id"],
+  "remote_resource": ["product_id", "resource_id", "priority"],
+  "product_detail": ["product_id"],
+  "product_attribution": ["product_id"],
+}
+
+def blanks_to_null(tables):
+  # blank CSV cells are read as NaN and turned into '' for building text, but Postgres rejects ''
+  # for timestamp and numeric columns, so empty strings are sent as NULL
+  return {table: df.where(df != '', None) for table, df in tables.items()}
+
+def constraint_error(table, keys):
+  return ValueError("Table {} has no unique constraint on ({}) to upsert on, add one with ALTER TABLE {} ADD UNIQUE ({})".format(
+    table, ", ".join(keys), quote_identifier(table), ", ".join(quote_identifier(k) for k in keys)))
+
+def copy_text_value(value):
+  # a value in COPY's text format, NULL is \N and backslash, tab and line breaks are escaped
+  if is_null(value):
+    return "\\N"
+  return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+def copy_text_lines(df):
+  for row in df.itertuples(index=False, name=None):
+    yield "\t".join(copy_text_value(v) for v in row) + "\n"
+
+# file-like over a generator of lines, so COPY streams rows without building the whole payload
+class LineReader:
+  def __init__(self, lines):
+    self.lines = lines
+    self.buffer = ""
+
+  def read(self, size=-1):
+    while size < 0 or len(self.buffer) < size:
+      try:
+        self.buffer += next(self.lines)
+      except StopIteration:
+        break
+    if size < 0:
+      data, self.buffer = self.buffer, ""
+    else:
+      data, self.buffer = self.buffer[:size], self.buffer[size:]
+    return data
+
+  def readline(self, size=-1):
+    return self.read(size)
+
+def quote_identifier(name):
+  return '"{}"'.format(name.replace('"', '""'))
+
+def upsert_sql(table, staging, columns, keys):
+  cols = ", ".join(quote_identifier(c) for c in columns)
+  updates = ", ".join("{0} = EXCLUDED.{0}".format(quote_identifier(c)) for c in columns if c not in keys)
+  conflict = "DO UPDATE SET {}".format(updates) if updates else "DO NOTHING"
+  # WHERE true keeps sqlite from reading ON CONFLICT as part of a join
+  return "INSERT INTO {} ({}) SELECT {} FROM {} WHERE true ON CONFLICT ({}) {}".format(
+    quote_identifier(table), cols, cols, quote_identifier(staging), ", ".join(quote_identifier(k) for k in keys), conflict)
+
+class PostgresSink:
+  def __init__(self, url):
+    try:
+      import psycopg2
+    except ImportError:
+      raise ValueError("Publishing to {} needs psycopg2, pip install psycopg2-binary".format(urllib.parse.urlsplit(url).scheme))
+    self.conn = psycopg2.connect(url)
+    self.check_constraints()
+
+  def check_constraints(self):
+    # ON CONFLICT needs a unique index on exactly the key columns, fail before loading anything
+    with self.conn:
+      with self.conn.cursor() as cur:
+        for table, keys in table_keys.items():
+          cur.execute("SELECT to_regclass(%s)", (quote_identifier(table),))
+          if cur.fetchone()[0] is None:
+            raise ValueError("Table {} doesn't exist in the database".format(table))
+          cur.execute("""
+            SELECT ARRAY(SELECT a.attname::text FROM unnest(i.indkey) k JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k)
+            FROM pg_index i WHERE i.indrelid = %s::regclass AND i.indisunique AND i.indpred IS NULL
+          """, (quote_identifier(table),))
+          if not any(set(row[0]) == set(keys) for row in cur.fetchall()):
+            raise constraint_error(table, keys)
+
+  def load(self, tables):
+    # tables is {table name: DataFrame}, loaded in a single transaction
+    with self.conn:
+      with self.conn.cursor() as cur:
+        for table, df in tables.items():
+          staging = "staging_{}".format(table)
+          columns = list(df.columns)
+          cur.execute("CREATE TEMP TABLE {} (LIKE {} INCLUDING DEFAULTS) ON COMMIT DROP".format(quote_identifier(staging), quote_identifier(table)))
+          cur.copy_expert("COPY {} ({}) FROM STDIN".format(quote_identifier(staging), ", ".join(quote_identifier(c) for c in columns)), LineReader(copy_text_lines(df)))
+          cur.execute(upsert_sql(table, staging, columns, table_keys[table]))
+          print("published {} rows to {}".format(cur.rowcount, table))
+
+  def close(self):
+    self.conn.close()
+
+class SqliteSink:
+  def __init__(self, url):
+    import sqlite3
+    path = urllib.parse.urlsplit(url).path
+    # sqlite:///relative.db and sqlite:////absolute.db, as in SQLAlchemy URLs
+    self.conn = sqlite3.connect(path[1:] if path.startswith("/") else path, isolation_level=None)
+
+  def load(self, tables):
+    cur = self.conn.cursor()
+    cur.execute("BEGIN")
+    try:
+      for table, df in tables.items():
+        staging = "staging_{}".format(table)
+        columns = list(df.columns)
+        keys = table_keys[table]
+        # sqlite stores '' in any column, check what Postgres would reject
+        for column in columns:
+          if (df[column] == '').any():
+            raise ValueError("Column {}.{} has empty strings, Postgres needs NULL for blank values".format(table, column))
+        # the real schema lives in Postgres, the stand-in only needs the columns and the key
+        cur.execute("CREATE TABLE IF NOT EXISTS {} ({}, UNIQUE ({}))".format(
+          quote_identifier(table), ", ".join(quote_identifier(c) for c in columns), ", ".join(quote_identifier(k) for k in keys)))
+        cur.execute("CREATE TEMP TABLE {} AS SELECT {} FROM {} WHERE 0".format(
+          quote_identifier(staging), ", ".join(quote_identifier(c) for c in columns), quote_identifier(table)))
+        cur.executemany("INSERT INTO {} VALUES ({})".format(quote_identifier(staging), ", ".join("?" for _ in columns)),
+          ([None if is_null(v) else v for v in row] for row in df.itertuples(index=False, name=None)))
+        cur.execute(upsert_sql(table, staging, columns, keys))
+        print("published {} rows to {}".format(cur.rowcount, table))
+        cur.execute("DROP TABLE {}".format(quote_identifier(staging)))
+      cur.execute("COMMIT")
+    except Exception:
+      cur.execute("ROLLBACK")
+      raise
+
+  def close(self):
+    self.conn.close()
+
+def open_sink(url):
+  scheme = urllib.parse.urlsplit(url).scheme
+  if scheme in ("postgres", "postgresql"):
+    return PostgresSink(url)
+  if scheme == "sqlite":
+    return SqliteSink(url)
+  raise ValueError("Unsupported database URL {}, expected postgresql:// or sqlite://".format(url))
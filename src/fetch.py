@@ -0,0 +1,289 @@
+import os
+import json
+import time
+import asyncio
+import threading
+import http.client
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from ipfs_multihash import UnixfsHasher
+
+# Concurrent downloader used to mirror the CDN, IPFS and Sia trees.
+# Requests run on worker threads through per-host pools of keep-alive connections,
+# while asyncio bounds how many downloads each backend (cdn/ipfs/sia) serves at once.
+
+default_concurrency = {
+  "cdn": 8,
+  "ipfs": 4,
+  "sia": 4,
+}
+
+read_size = 262144
+max_redirects = 5
+redirect_statuses = {301, 302, 303, 307, 308}
+retry_statuses = {408, 429, 500, 502, 503, 504}
+
+class RetryableStatus(Exception):
+  pass
+
+# Append-only JSON lines record of a mirror run: every planned download and every completion.
+# A crashed run can be resumed from it without re-planning, see DownloadJournal.pending.
+class DownloadJournal:
+  def __init__(self, path, resume=False):
+    self.path = path
+    self.lock = threading.Lock()
+    self.planned = {}
+    self.done = set()
+    if resume and os.path.exists(path):
+      with open(path, 'r') as f:
+        for line in f:
+          try:
+            entry = json.loads(line)
+          except ValueError:
+            # a crash can leave a torn last line
+            continue
+          if entry["event"] == "planned":
+            self.planned[entry["file_path"]] = (entry["url"], entry["backend"], entry["file_path"], entry["multihash"])
+          elif entry["event"] == "done":
+            self.done.add(entry["file_path"])
+      self.file = open(path, 'a')
+    else:
+      os.makedirs(os.path.dirname(path), exist_ok=True)
+      self.file = open(path, 'w')
+
+  def pending(self):
+    return [job for file_path, job in self.planned.items() if file_path not in self.done]
+
+  def write(self, entry):
+    with self.lock:
+      self.file.write(json.dumps(entry) + "\n")
+      self.file.flush()
+
+  def plan(self, jobs):
+    for url, backend, file_path, multihash in jobs:
+      if file_path not in self.planned:
+        self.planned[file_path] = (url, backend, file_path, multihash)
+        self.write({"event": "planned", "url": url, "backend": backend, "file_path": file_path, "multihash": multihash})
+
+  def complete(self, file_path, multihash):
+    with self.lock:
+      self.done.add(file_path)
+    self.write({"event": "done", "file_path": file_path, "multihash": multihash})
+
+  def progress(self):
+    return "{}/{} planned downloads done".format(len(self.done & set(self.planned)), len(self.planned))
+
+  def close(self):
+    self.file.close()
+
+class ConnectionPool:
+  def __init__(self, scheme, netloc, timeout):
+    self.scheme = scheme
+    self.netloc = netloc
+    self.timeout = timeout
+    self.idle = []
+    self.lock = threading.Lock()
+    self.opened = 0
+
+  def acquire(self):
+    with self.lock:
+      if self.idle:
+        return self.idle.pop()
+      self.opened += 1
+    if self.scheme == "https":
+      return http.client.HTTPSConnection(self.netloc, timeout=self.timeout)
+    return http.client.HTTPConnection(self.netloc, timeout=self.timeout)
+
+  def release(self, conn):
+    with self.lock:
+      self.idle.append(conn)
+
+  def close(self):
+    with self.lock:
+      for conn in self.idle:
+        conn.close()
+      self.idle = []
+
+class Fetcher:
+  def __init__(self, concurrency=None, retries=3, backoff=0.5, timeout=60, journal=None):
+    self.concurrency = dict(default_concurrency)
+    self.concurrency.update(concurrency or {})
+    self.retries = retries
+    self.backoff = backoff
+    self.timeout = timeout
+    self.pools = {}
+    self.pools_lock = threading.Lock()
+    # the counters below are updated from the download threads
+    self.lock = threading.Lock()
+    self.requests = 0
+    self.retried = 0
+    self.bytes_received = 0
+    self.resumed = 0
+    # {file_path: (seconds, attempts)} of every completed download, for per-file profiling
+    self.timings = {}
+    self.journal = journal
+
+  def pool(self, scheme, netloc):
+    with self.pools_lock:
+      key = (scheme, netloc)
+      if key not in self.pools:
+        self.pools[key] = ConnectionPool(scheme, netloc, self.timeout)
+      return self.pools[key]
+
+  def close(self):
+    for pool in self.pools.values():
+      pool.close()
+
+  def request(self, url, headers=None):
+    # returns (pool, conn, response) for a 2xx response, following redirects
+    for _ in range(max_redirects + 1):
+      parsed = urllib.parse.urlsplit(url)
+      pool = self.pool(parsed.scheme, parsed.netloc)
+      conn = pool.acquire()
+      path = parsed.path or "/"
+      if parsed.query:
+        path += "?" + parsed.query
+      try:
+        conn.request("GET", path, headers=headers or {})
+        resp = conn.getresponse()
+      except Exception:
+        conn.close()
+        raise
+      with self.lock:
+        self.requests += 1
+
+      # 416 means a resumed range starts at the end of the body, the caller decides what that means
+      if 200 <= resp.status < 300 or (resp.status == 416 and "Range" in (headers or {})):
+        return pool, conn, resp
+      resp.read()
+      pool.release(conn)
+      if resp.status in redirect_statuses:
+        url = urllib.parse.urljoin(url, resp.getheader("Location"))
+        continue
+      if resp.status in retry_statuses:
+        raise RetryableStatus("HTTP {}".format(resp.status))
+      raise ValueError("({}) HTTP {} {}".format(url, resp.status, resp.reason))
+    raise ValueError("({}) Too many redirects".format(url))
+
+  def download(self, url, file_path, multihash=None, max_bytes=None):
+    # the body is hashed while it streams into file_path.part, which is only renamed to
+    # file_path once its multihash matches, so every byte is read exactly once
+    # an existing .part left by an interrupted attempt or run is resumed with a Range request
+    part_path = file_path + ".part"
+    hasher = UnixfsHasher()
+    offset = 0
+    if os.path.exists(part_path):
+      with open(part_path, 'rb') as f:
+        while True:
+          data = f.read(read_size)
+          if not data:
+            break
+          hasher.update(data)
+      offset = hasher.size
+
+    headers = {"Range": "bytes={}-".format(offset)} if offset else {}
+    pool, conn, resp = self.request(url, headers)
+    if resp.status == 416:
+      # nothing left to fetch, the .part already holds the whole body
+      resp.read()
+      pool.release(conn)
+    else:
+      if resp.status != 206 and offset:
+        # server ignored the range, start over
+        hasher = UnixfsHasher()
+        offset = 0
+      elif resp.status == 206 and not (resp.getheader("Content-Range") or "").startswith("bytes {}-".format(offset)):
+        conn.close()
+        self.discard(part_path)
+        raise RetryableStatus("unexpected Content-Range {}".format(resp.getheader("Content-Range")))
+      length = resp.getheader("Content-Length")
+      if max_bytes is not None and length is not None and offset + int(length) > max_bytes:
+        conn.close()
+        self.discard(part_path)
+        raise ValueError("({}) Content-Length {} exceeds limit of {} bytes".format(url, offset + int(length), max_bytes))
+
+      received = 0
+      try:
+        with open(part_path, 'ab' if offset else 'wb') as f:
+          while True:
+            data = resp.read(read_size)
+            if not data:
+              break
+            if max_bytes is not None and hasher.size + len(data) > max_bytes:
+              self.discard(part_path)
+              raise ValueError("({}) Body exceeds limit of {} bytes".format(url, max_bytes))
+            hasher.update(data)
+            f.write(data)
+            received += len(data)
+        # http.client returns a short body instead of raising when the peer hangs up early
+        if length is not None and received < int(length):
+          raise http.client.IncompleteRead(b'', int(length) - received)
+      except Exception:
+        # keep the .part so the next attempt resumes where this one stopped
+        conn.close()
+        raise
+      finally:
+        with self.lock:
+          self.bytes_received += received
+      pool.release(conn)
+      if offset:
+        with self.lock:
+          self.resumed += 1
+
+    m = hasher.multihash()
+    if multihash is not None and m != multihash:
+      self.discard(part_path)
+      raise ValueError("({}) Bad multihash, {} != {}".format(url, multihash, m))
+    os.replace(part_path, file_path)
+    if self.journal is not None:
+      self.journal.complete(file_path, m)
+    return m
+
+  def discard(self, part_path):
+    if os.path.exists(part_path):
+      os.remove(part_path)
+
+  def download_with_retries(self, url, file_path, multihash=None, max_bytes=None):
+    start = time.perf_counter()
+    for attempt in range(self.retries + 1):
+      try:
+        m = self.download(url, file_path, multihash, max_bytes)
+        with self.lock:
+          self.timings[file_path] = (time.perf_counter() - start, attempt + 1)
+        return m
+      except (OSError, http.client.HTTPException, RetryableStatus) as e:
+        if attempt == self.retries:
+          raise ValueError("({}) Failed after {} attempts: {}".format(url, attempt + 1, e))
+        with self.lock:
+          self.retried += 1
+        time.sleep(self.backoff * 2 ** attempt)
+
+  async def fetch(self, semaphores, executor, url, backend, file_path, multihash, max_bytes):
+    async with semaphores[backend]:
+      loop = asyncio.get_running_loop()
+      m = await loop.run_in_executor(executor, self.download_with_retries, url, file_path, multihash, max_bytes)
+      print("Fetched {}".format(url))
+      return m
+
+  async def fetch_all_async(self, jobs, max_bytes):
+    semaphores = {k: asyncio.Semaphore(v) for k, v in self.concurrency.items()}
+    with ThreadPoolExecutor(max_workers=sum(self.concurrency.values())) as executor:
+      return await asyncio.gather(
+        *[self.fetch(semaphores, executor, url, backend, file_path, multihash, max_bytes) for url, backend, file_path, multihash in jobs],
+        return_exceptions=True
+      )
+
+  def fetch_all(self, jobs, max_bytes=None):
+    # jobs are (url, backend, file_path, expected multihash or None) tuples
+    # returns ({file_path: multihash} of completed downloads, [errors of failed downloads])
+    if self.journal is not None:
+      self.journal.plan(jobs)
+    results = asyncio.run(self.fetch_all_async(jobs, max_bytes))
+    errors = [r for r in results if isinstance(r, Exception)]
+    for e in errors:
+      print("Error: {}".format(e))
+    return {job[2]: m for job, m in zip(jobs, results) if not isinstance(m, Exception)}, errors
+
+  def summary(self):
+    connections = sum(p.opened for p in self.pools.values())
+    return "fetched {} bytes in {} requests over {} connections, {} retries, {} resumed".format(self.bytes_received, self.requests, connections, self.retried, self.resumed)
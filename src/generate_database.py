@@ -1,26 +1,36 @@
 import pandas as pd
 import os
 from pathlib import Path
-import yaml
-import subprocess
 import numpy as np
 import json
-
-script_dir = os.path.dirname(os.path.realpath(__file__))
-
-out_dir = os.path.join(script_dir, "../out")
-data_dir = os.path.join(script_dir, "../data")
-index_dir = os.path.join(script_dir, "../index")
-static_dir = os.path.join(script_dir, "../static")
-
-org_csv = os.path.join(data_dir, "organization.csv")
-mkt_csv = os.path.join(data_dir, "market.csv")
-chr_csv = os.path.join(data_dir, "characters_master.csv")
-bundles_csv = os.path.join(data_dir, "bundles.csv")
-
-static_csv = os.path.join(index_dir, "index.csv")
-config_dir = os.path.join(script_dir, "../config")
-cfg_yaml = os.path.join(config_dir, "config.yaml")
+import argparse
+from table_builder import TableBuilder
+from db_sink import open_sink, blanks_to_null
+from postgres_text import encode_array
+from tx_metadata import chunk_long_strings, encode_metadata
+from build_manifest import BuildManifest, fingerprint, write_if_changed
+from project import add_project_arguments, project_from_args
+
+# config.yaml keys that end up in nvla.json / onchain.json
+metadata_cfg_keys = [
+  'novellia_version',
+  'copyright',
+  'publisher',
+  'product_version',
+  'extension',
+  'policy_id',
+  'description_short',
+  'description_long',
+  'description_long_metadata',
+  'tags',
+  'commission_name',
+  'commission_address',
+  'commission_percent',
+  'static_host',
+]
+
+character_resources = ['card_low.jpg', 'card.png', 'artwork_low.jpg', 'artwork.png', 'video.mp4', 'character.json']
+bundle_resources = ['card_low.jpg', 'card.png']
 
 def mime_type_from_file_path(file_path):
   _, file_extension = os.path.splitext(file_path)
@@ -35,33 +45,34 @@ def mime_type_from_file_path(file_path):
   except Exception as e:
     raise ValueError("Unknown MimeType for file {}, detected extension {}".format(file_path, file_extension))
 
-def list_to_postgres_text(l):
-  if np.nan in l or not l or len(l) == 0:
-    return ''
-  text = '{'
-  for i in range(len(l)):
-    text += str(l[i])
-    if i < len(l) - 1:
-      text += ','
-  text += '}'
-  return text
-
-def get_ipfs_multihash(file_path):
-  # requires that script caller has IPFS installed
-  result = subprocess.run(['ipfs', 'add', file_path, '--only-hash', '-q'], stdout=subprocess.PIPE)
-  return result.stdout.decode('utf-8').strip()
+def add_arguments(parser):
+  parser.add_argument("--incremental", action="store_true", help="only regenerate nvla.json and onchain.json for products whose inputs changed")
+  parser.add_argument("--database", help="also upsert the tables into this postgresql:// (or sqlite:// stand-in) database")
+
+def run(project, args):
+  build(project, incremental=args.incremental, database=args.database)
+
+def build(project, incremental=False, database=None):
+  # writes the database CSVs to out/ and nvla.json / onchain.json of every product to static/,
+  # the documents are also kept on project for the steps that follow in the same run
+  hash_cache = project.hash_cache
+  build_manifest = BuildManifest(os.path.join(project.cache_dir, "build_manifest.json"))
+  skipped_products = 0
+  # CBOR bytes of each onchain.json written in this run
+  onchain_sizes = []
+  out_dir = project.out_dir
+
+  org_csv = os.path.join(project.data_dir, "organization.csv")
+  mkt_csv = os.path.join(project.data_dir, "market.csv")
+  chr_csv = os.path.join(project.data_dir, "characters_master.csv")
+  bundles_csv = os.path.join(project.data_dir, "bundles.csv")
 
-if __name__ == "__main__":
   # read export configuration
-  print("reading export config from {}".format(cfg_yaml))
-  with open(cfg_yaml, 'r') as cfg_file:
-    cfg = yaml.full_load(cfg_file)
+  cfg = project.cfg
   print(cfg)
 
   # read static serving index
-  print("reading static serving index from {}".format(static_csv))
-  static_df = pd.read_csv(static_csv)
-  print(static_df.head())
+  static_index = project.static_index
 
   # read organizations
   print("reading organizations from {}".format(org_csv))
@@ -89,13 +100,28 @@ if __name__ == "__main__":
   bundles_df = bundles_df.replace(np.nan, '', regex=True)
   print(bundles_df.head())
 
+  # the cards exported by this config, include_cards holds 1-based row numbers
+  cards_df = chr_df[(chr_df.index + 1).isin(cfg['include_cards'])]
+
+  # hash every resource file up front across a worker pool
+  resource_paths = []
+  for product_id in cards_df['product_id']:
+    nanoid = static_index.nanoid(product_id)
+    resource_paths.extend(os.path.join(project.product_dir(nanoid), 'resource', r) for r in character_resources)
+  for product_id in bundles_df['product_id']:
+    nanoid = static_index.nanoid(product_id)
+    resource_paths.extend(os.path.join(project.product_dir(nanoid), 'resource', r) for r in bundle_resources)
+  resource_paths = [p for p in resource_paths if os.path.isfile(p)]
+  print("hashing {} resource files with {} jobs".format(len(resource_paths), project.jobs))
+  resource_multihashes = hash_cache.get_multihashes(resource_paths, jobs=project.jobs)
+
   # create dataframes according to schema
-  native_token_df = pd.DataFrame(columns=[
+  native_token_table = TableBuilder([
     'native_token_id',
     'policy_id',
     'asset_id'
   ])
-  product_df = pd.DataFrame(columns=[
+  product_table = TableBuilder([
     'product_id',
     'product_name',
     'organization_id',
@@ -107,13 +133,13 @@ if __name__ == "__main__":
     'date_available',
     'native_token_id',
   ])
-  commission_df = pd.DataFrame(columns=[
+  commission_table = TableBuilder([
     'product_id',
     'recipient_name',
     'recipient_address',
     'commission_percent',
   ])
-  remote_resource_df = pd.DataFrame(columns=[
+  remote_resource_table = TableBuilder([
     'product_id',
     'resource_id',
     'resource_description',
@@ -123,7 +149,7 @@ if __name__ == "__main__":
     'resource_urls',
     'content_type',
   ])
-  product_detail_df = pd.DataFrame(columns=[
+  product_detail_table = TableBuilder([
     'product_id',
     'copyright',
     'publisher',
@@ -135,7 +161,7 @@ if __name__ == "__main__":
     'stock_available',
     'total_supply',
   ])
-  product_attribution_df = pd.DataFrame(columns=[
+  product_attribution_table = TableBuilder([
     'product_id',
     'author_name',
     'author_urls',
@@ -143,71 +169,93 @@ if __name__ == "__main__":
   ])
 
   # generate data to insert to DB
-  for index, row in chr_df.iterrows():
-    if index + 1 not in cfg['include_cards']:
-      continue
-    # insert native token
-    # generate asset_id
-    # - replace dashes with spaces
-    # - capitalize first letter of each word
-    # - strip whitespace
-    asset_id = row['product_name']
-    asset_id = asset_id.replace('-', ' ').title().replace(' ', '')
-    native_token = {
-      'native_token_id': "{}.{}".format(cfg['policy_id'], asset_id),
-      'policy_id': cfg['policy_id'],
-      'asset_id': asset_id,
-    }
-    native_token_df = native_token_df.append(native_token, ignore_index=True)
-
-    # determine price from rarity
-    if row['card_rarity'] == 'Rare':
-      price = cfg['price_rare']
-    elif row['card_rarity'] == 'Kinda Rare':
-      price = cfg['price_kinda_rare']
-    elif row['card_rarity'] == 'Not That Rare':
-      price = cfg['price_not_that_rare']
-
-    # insert product
-    product = {
-      'product_id': row['product_id'],
-      'product_name': row['product_name'],
-      'organization_id': cfg['organization_id'],
-      'market_id': cfg['market_id'],
-      'price_currency_id': cfg['price_currency'],
-      'price_unit_amount': price,
-      'max_order_size': cfg['max_order_size'],
-      'date_listed': row['date_listed'],
-      'date_available': row['date_available'],
-      'native_token_id': native_token['native_token_id'],
-    }
-    product_df = product_df.append(product, ignore_index=True)
-
-    # insert commission
-    commission = {
-      'product_id': row['product_id'],
-      'recipient_name': cfg['commission_name'],
-      'recipient_address': cfg['commission_address'],
-      'commission_percent': cfg['commission_percent'],
-    }
-    commission_df = commission_df.append(commission, ignore_index=True)
-
+  # columns derived from the card list are computed over whole columns, only file I/O is per product
+
+  # generate asset_id
+  # - replace dashes with spaces
+  # - capitalize first letter of each word
+  # - strip whitespace
+  asset_ids = cards_df['product_name'].str.replace('-', ' ', regex=False).str.title().str.replace(' ', '', regex=False)
+  native_token_ids = cfg['policy_id'] + '.' + asset_ids
+
+  # determine price from rarity
+  rarity_prices = pd.Series({
+    'Rare': cfg['price_rare'],
+    'Kinda Rare': cfg['price_kinda_rare'],
+    'Not That Rare': cfg['price_not_that_rare'],
+  }, dtype=object)
+  unknown_rarities = set(cards_df['card_rarity']) - set(rarity_prices.index)
+  if unknown_rarities:
+    raise ValueError("Unknown card_rarity {}".format(sorted(unknown_rarities)))
+  prices = cards_df['card_rarity'].map(rarity_prices)
+
+  # insert native tokens
+  native_token_table.extend(pd.DataFrame({
+    'native_token_id': native_token_ids,
+    'policy_id': cfg['policy_id'],
+    'asset_id': asset_ids,
+  }))
+
+  # insert products
+  product_table.extend(pd.DataFrame({
+    'product_id': cards_df['product_id'],
+    'product_name': cards_df['product_name'],
+    'organization_id': cfg['organization_id'],
+    'market_id': cfg['market_id'],
+    'price_currency_id': cfg['price_currency'],
+    'price_unit_amount': prices,
+    'max_order_size': cfg['max_order_size'],
+    'date_listed': cards_df['date_listed'],
+    'date_available': cards_df['date_available'],
+    'native_token_id': native_token_ids,
+  }))
+
+  # insert commissions
+  commission_table.extend(pd.DataFrame({
+    'product_id': cards_df['product_id'],
+    'recipient_name': cfg['commission_name'],
+    'recipient_address': cfg['commission_address'],
+    'commission_percent': cfg['commission_percent'],
+  }))
+
+  # insert product details
+  product_detail_table.extend(pd.DataFrame({
+    'product_id': cards_df['product_id'],
+    'copyright': cfg['copyright'],
+    'publisher': encode_array(cfg['publisher']),
+    'product_version': cfg['product_version'],
+    'id': cards_df['card_number'],
+    'tags': encode_array(cfg['tags']),
+    'description_short': cfg['description_short'],
+    'description_long': "# Product\n\n{}\n\n# Character Lore\n\n".format(cfg['description_long']) + cards_df['lore'].astype(str),
+  }))
+
+  # insert product attributions
+  attributed_df = cards_df[cards_df['author_name'].astype(bool)]
+  product_attribution_table.extend(pd.DataFrame({
+    'product_id': attributed_df['product_id'],
+    'author_name': attributed_df['author_name'],
+    'author_urls': attributed_df['author_url'].map(lambda url: encode_array([url] if url else [])),
+    'work_attributed': attributed_df['product_name'] + " Illustration",
+  }))
+
+  for row, asset_id in zip(cards_df.to_dict('records'), asset_ids):
+    project.profiler.product(row['product_id'])
     # insert remote resources
-    # TODO: learn how to use Pandas because this query is embarrasing
-    nanoid = static_df[static_df['product_id'] == row['product_id']]['nanoid'].tolist()[0]
-    static_base_url = "{}/{}".format(cfg['static_host'], nanoid)
+    nanoid = static_index.nanoid(row['product_id'])
+    static_base_url = project.product_url(nanoid)
     static_resource_base_url = "{}/{}".format(static_base_url, 'resource')
-    static_base_path = os.path.join(static_dir, nanoid)
+    static_base_path = project.product_dir(nanoid)
     static_resource_base_path = os.path.join(static_base_path, 'resource')
 
     remote_resource_list = []
     card_low_multihash = ""
-    for r in ['card_low.jpg', 'card.png', 'artwork_low.jpg', 'artwork.png', 'video.mp4', 'character.json']:
+    for r in character_resources:
       r_path = Path(os.path.join(static_resource_base_path, r))
       if not r_path.is_file():
         continue
 
-      ipfs_multihash = get_ipfs_multihash(r_path)
+      ipfs_multihash = resource_multihashes[str(r_path)]
       if r == 'card_low.jpg':
         card_low_multihash = ipfs_multihash
 
@@ -250,38 +298,27 @@ if __name__ == "__main__":
         'multihash': ipfs_multihash,
         # we are using a multihash generated from IPFS (which uses unixfs)
         'hash_source_type': "ipfs",
-        'resource_urls': list_to_postgres_text(resource_urls),
+        'resource_urls': encode_array(resource_urls),
         'content_type': mime_type_from_file_path(r_path),
       }
-      remote_resource_df = remote_resource_df.append(remote_resource, ignore_index=True)
+      remote_resource_table.append(remote_resource)
       remote_resource_list.append(remote_resource)
       remote_resource_list[-1]['resource_urls'] = resource_urls
 
-    # insert product detail
-    description_with_lore = "# Product\n\n{}\n\n# Character Lore\n\n{}".format(cfg['description_long'], row['lore'])
-    product_detail = {
-      'product_id': row['product_id'],
-      'copyright': cfg['copyright'],
-      'publisher': list_to_postgres_text(cfg['publisher']),
-      'product_version': cfg['product_version'],
-      'id': row['card_number'],
-      'tags': list_to_postgres_text(cfg['tags']),
-      'description_short': cfg['description_short'],
-      'description_long': description_with_lore,
-      #'stock_available': ,
-      #'total_supply': ,
-    }
-    product_detail_df = product_detail_df.append(product_detail, ignore_index=True)
-
-    # insert product attribution
-    if row['author_name']:
-      product_attribution = {
-        'product_id': row['product_id'],
-        'author_name': row['author_name'],
-        'author_urls': list_to_postgres_text([row['author_url']]),
-        'work_attributed': "{} Illustration".format(row['product_name']),
-      }
-      product_attribution_df = product_attribution_df.append(product_attribution, ignore_index=True)
+    # skip unchanged products in incremental mode
+    nvla_resource_path = os.path.join(static_base_path,  "nvla.json")
+    onchain_resource_path = os.path.join(static_base_path,  "onchain.json")
+    input_fingerprint = fingerprint({
+      "row": row,
+      "cfg": {k: cfg[k] for k in metadata_cfg_keys},
+      "nanoid": nanoid,
+      "static_base_url": static_base_url,
+      "resources": {r["resource_description"]: r["multihash"] for r in remote_resource_list},
+    })
+    output_paths = {"nvla.json": nvla_resource_path, "onchain.json": onchain_resource_path}
+    if incremental and build_manifest.is_current(row['product_id'], input_fingerprint, output_paths, hash_cache):
+      skipped_products += 1
+      continue
 
     # write novellia resource
     nvla_resource_json = {
@@ -321,12 +358,11 @@ if __name__ == "__main__":
         "url": r["resource_urls"],
         "content_type": r["content_type"],
       })
-    nvla_resource_path = os.path.join(static_base_path,  "nvla.json")
-    with open(nvla_resource_path, 'w') as nvla_file:
-      json.dump(nvla_resource_json, nvla_file, indent=2)
+    write_if_changed(nvla_resource_path, json.dumps(nvla_resource_json, indent=2))
+    project.set_artifact(nanoid, "nvla.json", nvla_resource_json)
 
     # write on-chain metadata
-    nvla_resource_multihash = get_ipfs_multihash(nvla_resource_path)
+    nvla_resource_multihash = hash_cache.get_multihash(nvla_resource_path)
     nvla_resource = {
       "resource_id": "Novellia",
       "description": "Off-chain Novellia extended metadata",
@@ -340,8 +376,6 @@ if __name__ == "__main__":
       ],
       "content_type": "application/json",
     }
-    os.path.join(static_base_path,  "onchain.json")
-    onchain_resource_path = os.path.join(static_base_path,  "onchain.json")
     if card_low_multihash == "":
       raise ValueError("card_low_multihash is empty for {}".format(row["product_name"]))
     onchain_resource = {
@@ -366,39 +400,56 @@ if __name__ == "__main__":
         }
       },
     }
-    with open(onchain_resource_path, 'w') as onchain_file:
-      json.dump(onchain_resource, onchain_file, indent=2)
+    # mint transactions only carry strings of up to 64 bytes, longer ones become lists of chunks,
+    # and encoding fails on anything else a transaction can't carry, e.g. floats
+    onchain_resource = chunk_long_strings(onchain_resource)
+    onchain_sizes.append(len(encode_metadata(onchain_resource)))
+    write_if_changed(onchain_resource_path, json.dumps(onchain_resource, indent=2))
+    project.set_artifact(nanoid, "onchain.json", onchain_resource)
+    build_manifest.record(row['product_id'], input_fingerprint, {
+      "nvla.json": nvla_resource_multihash,
+      "onchain.json": hash_cache.get_multihash(onchain_resource_path),
+    })
+
+  project.profiler.product(None)
 
   # add bundles
-  for index, row in bundles_df.iterrows():
-    # insert product
-    product = {
-      'product_id': row['product_id'],
-      'product_name': row['product_name'],
-      'organization_id': cfg['organization_id'],
-      'market_id': cfg['market_id'],
-      'price_currency_id': cfg['price_currency'],
-      'price_unit_amount': row['price'],
-      'max_order_size': cfg['max_order_size'],
-      'date_listed': row['date_listed'],
-      'date_available': row['date_available'],
-    }
-    product_df = product_df.append(product, ignore_index=True)
-
+  product_table.extend(pd.DataFrame({
+    'product_id': bundles_df['product_id'],
+    'product_name': bundles_df['product_name'],
+    'organization_id': cfg['organization_id'],
+    'market_id': cfg['market_id'],
+    'price_currency_id': cfg['price_currency'],
+    'price_unit_amount': bundles_df['price'],
+    'max_order_size': cfg['max_order_size'],
+    'date_listed': bundles_df['date_listed'],
+    'date_available': bundles_df['date_available'],
+  }))
+  product_detail_table.extend(pd.DataFrame({
+    'product_id': bundles_df['product_id'],
+    'copyright': cfg['copyright'],
+    'publisher': encode_array(cfg['publisher']),
+    'product_version': cfg['product_version'],
+    'tags': encode_array(cfg['tags_bundle']),
+    'description_short': cfg['description_short_bundle'],
+    'description_long': bundles_df['description'],
+  }))
+
+  for row in bundles_df.to_dict('records'):
+    project.profiler.product(row['product_id'])
     # insert remote resources
-    # TODO: learn how to use Pandas because this query is embarrasing
-    nanoid = static_df[static_df['product_id'] == row['product_id']]['nanoid'].tolist()[0]
-    static_base_url = "{}/{}".format(cfg['static_host'], nanoid)
+    nanoid = static_index.nanoid(row['product_id'])
+    static_base_url = project.product_url(nanoid)
     static_resource_base_url = "{}/{}".format(static_base_url, 'resource')
-    static_base_path = os.path.join(static_dir, nanoid)
+    static_base_path = project.product_dir(nanoid)
     static_resource_base_path = os.path.join(static_base_path, 'resource')
 
-    for r in ['card_low.jpg', 'card.png']:
+    for r in bundle_resources:
       r_path = Path(os.path.join(static_resource_base_path, r))
       if not r_path.is_file():
         continue
 
-      ipfs_multihash = get_ipfs_multihash(r_path)
+      ipfs_multihash = resource_multihashes[str(r_path)]
 
       resource_urls = []
       # Static Hosting
@@ -419,26 +470,50 @@ if __name__ == "__main__":
         'multihash': ipfs_multihash,
         # we are using a multihash generated from IPFS (which uses unixfs)
         'hash_source_type': "ipfs",
-        'resource_urls': list_to_postgres_text(resource_urls),
+        'resource_urls': encode_array(resource_urls),
         'content_type': mime_type_from_file_path(r_path),
       }
-      remote_resource_df = remote_resource_df.append(remote_resource, ignore_index=True)
-
-    product_detail = {
-      'product_id': row['product_id'],
-      'copyright': cfg['copyright'],
-      'publisher': list_to_postgres_text(cfg['publisher']),
-      'product_version': cfg['product_version'],
-      'tags': list_to_postgres_text(cfg['tags_bundle']),
-      'description_short': cfg['description_short_bundle'],
-      'description_long': row['description'],
-    }
-    product_detail_df = product_detail_df.append(product_detail, ignore_index=True)
+      remote_resource_table.append(remote_resource)
+
+  project.profiler.product(None)
 
   # write CSVs
-  native_token_df.to_csv(os.path.join(out_dir, "native_token.csv"), index=False)
-  product_df.to_csv(os.path.join(out_dir, "product.csv"), index=False)
-  commission_df.to_csv(os.path.join(out_dir, "commission.csv"), index=False)
-  remote_resource_df.to_csv(os.path.join(out_dir, "remote_resource.csv"), index=False)
-  product_detail_df.to_csv(os.path.join(out_dir, "product_detail.csv"), index=False)
-  product_attribution_df.to_csv(os.path.join(out_dir, "product_attribution.csv"), index=False)
+  tables = {
+    "native_token": native_token_table.to_df(),
+    "product": product_table.to_df(),
+    "commission": commission_table.to_df(),
+    "remote_resource": remote_resource_table.to_df(),
+    "product_detail": product_detail_table.to_df(),
+    "product_attribution": product_attribution_table.to_df(),
+  }
+  os.makedirs(out_dir, exist_ok=True)
+  for table, df in tables.items():
+    df.to_csv(os.path.join(out_dir, "{}.csv".format(table)), index=False)
+
+  # publish the same rows, in one transaction
+  if database:
+    sink = open_sink(database)
+    try:
+      sink.load(blanks_to_null(tables))
+    finally:
+      sink.close()
+
+  if onchain_sizes:
+    print("on-chain metadata of {} products is {} to {} CBOR bytes".format(len(onchain_sizes), min(onchain_sizes), max(onchain_sizes)))
+  build_manifest.save()
+  if incremental:
+    print("skipped {} unchanged products".format(skipped_products))
+
+def main():
+  parser = argparse.ArgumentParser(description="Generate database CSVs and Novellia metadata from static assets")
+  add_project_arguments(parser)
+  add_arguments(parser)
+  args = parser.parse_args()
+  project = project_from_args(args)
+  try:
+    run(project, args)
+  finally:
+    project.close()
+
+if __name__ == "__main__":
+  main()
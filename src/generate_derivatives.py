@@ -0,0 +1,220 @@
+import io
+import math
+import os
+import sys
+import time
+import argparse
+from build_manifest import BuildManifest, fingerprint, write_if_changed
+from validate_resources import image_resource_specifications
+from project import add_project_arguments, project_from_args
+
+# Derives the low resolution JPGs of every product from its full resolution PNG, at the
+# dimensions and under the max_size of validate_resources.image_resource_specifications.
+# Sources are decoded at reduced size where the format allows it (JPEG draft mode, Pillow's
+# reduce() ahead of the final resample), and the JPEG quality is binary searched for the
+# highest quality that fits the byte budget. Derivatives whose source, spec and encoder
+# settings are unchanged since the last run are skipped.
+
+# derivative: source, in the same resource/ folder
+derivative_sources = {
+  'card_low.jpg': 'card.png',
+  'artwork_low.jpg': 'artwork.png',
+}
+
+# bump when the resampling or encoder settings change so every derivative is regenerated
+encoder_version = 1
+
+# an integer reduce() brings the source to within this factor of the target before the Lanczos resample
+reducing_gap = 3.0
+
+# typical growth of log(JPEG size) per quality step around quality 80, where budgets usually land
+quality_log_slope = 0.04
+
+# start of the stub git leaves in place of an image when LFS objects weren't pulled
+lfs_pointer_header = b"version https://git-lfs.github.com/spec/"
+
+def add_arguments(parser):
+  parser.add_argument("--force", action="store_true", help="regenerate every derivative, even if its source is unchanged")
+  parser.add_argument("--min-quality", type=int, default=30, help="lowest JPEG quality to try before giving up on the size budget")
+  parser.add_argument("--max-quality", type=int, default=90, help="JPEG quality used when it already fits the size budget")
+
+def run(project, args):
+  if not 1 <= args.min_quality <= args.max_quality <= 95:
+    raise ValueError("Expected 1 <= --min-quality <= --max-quality <= 95, got {} and {}".format(args.min_quality, args.max_quality))
+  return derive_all(project, force=args.force, min_quality=args.min_quality, max_quality=args.max_quality)
+
+def main():
+  parser = argparse.ArgumentParser(description="Derive card_low.jpg and artwork_low.jpg of every product from its PNGs")
+  add_project_arguments(parser)
+  add_arguments(parser)
+  args = parser.parse_args()
+  project = project_from_args(args)
+  try:
+    failed = run(project, args)
+  finally:
+    project.close()
+  if failed:
+    sys.exit(1)
+
+def crop_box(width, height, target_width, target_height):
+  # centered region of the source with the target's aspect ratio
+  if width * target_height > height * target_width:
+    cropped = height * target_width / target_height
+    return ((width - cropped) / 2, 0, (width + cropped) / 2, height)
+  cropped = width * target_height / target_width
+  return (0, (height - cropped) / 2, width, (height + cropped) / 2)
+
+def encode_jpeg(im, quality):
+  buffer = io.BytesIO()
+  im.save(buffer, format="JPEG", quality=quality, optimize=True)
+  return buffer.getvalue()
+
+def search_quality(im, max_size, min_quality, max_quality):
+  # highest quality in [min_quality, max_quality] whose encoding fits max_size, as (quality, data, encodes).
+  # Most sources fit at max_quality in one encode. Otherwise log(size) is nearly linear in quality,
+  # so each next quality is a secant step from the last two encodes (from a typical slope after the
+  # first), kept inside the bracket of the best quality known to fit and the lowest known not to.
+  # That takes about two thirds of the encodes of a binary search, and a bisection whenever two
+  # steps failed to halve a wide bracket keeps plateaus in the size curve from stalling it.
+  target = math.log(max_size)
+  low, low_data = min_quality - 1, None
+  high = max_quality + 1
+  widths = []
+  previous = None
+  slope = quality_log_slope
+  quality = max_quality
+  encodes = 0
+  while True:
+    data = encode_jpeg(im, quality)
+    encodes += 1
+    log_size = math.log(len(data))
+    if len(data) <= max_size:
+      low, low_data = quality, data
+    else:
+      high = quality
+    if high - low <= 1:
+      break
+    if low_data is None and quality == min_quality:
+      break
+
+    if previous is not None and log_size != previous[1]:
+      step_slope = (log_size - previous[1]) / (quality - previous[0])
+      if step_slope > 0:
+        slope = step_slope
+    previous = (quality, log_size)
+    widths.append(high - low)
+    if len(widths) >= 3 and 2 * widths[-1] > widths[-3] and widths[-1] > 8:
+      quality = (low + high) // 2
+    elif log_size <= target:
+      quality += math.floor((target - log_size) / slope)
+    else:
+      quality -= math.ceil((log_size - target) / slope)
+    quality = min(max(quality, low + 1, min_quality), high - 1)
+
+  if low_data is None:
+    raise ValueError("No JPEG quality down to {} fits {} bytes".format(min_quality, int(max_size)))
+  return low, low_data, encodes
+
+def is_lfs_pointer(path):
+  with open(path, 'rb') as f:
+    return f.read(len(lfs_pointer_header)) == lfs_pointer_header
+
+def derive(source_path, width, height, max_size, min_quality, max_quality):
+  # runs in a worker process, returns (quality, JPEG bytes, encodes, seconds)
+  start = time.perf_counter()
+  from PIL import Image
+  if is_lfs_pointer(source_path):
+    raise ValueError("{} is a Git LFS pointer, fetch the image with git lfs pull".format(source_path))
+  with Image.open(source_path) as im:
+    # lets the JPEG decoder scale by 1/2, 1/4 or 1/8 while decoding, a no-op for PNG
+    im.draft("RGB", (width, height))
+    if im.mode in ("RGBA", "LA") or (im.mode == "P" and "transparency" in im.info):
+      # JPEG has no alpha, flatten onto white
+      im = im.convert("RGBA")
+      flattened = Image.new("RGB", im.size, (255, 255, 255))
+      flattened.paste(im, mask=im.getchannel("A"))
+      im = flattened
+    elif im.mode != "RGB":
+      im = im.convert("RGB")
+    box = crop_box(im.width, im.height, width, height)
+    im = im.resize((width, height), Image.LANCZOS, box=box, reducing_gap=reducing_gap)
+  quality, data, encodes = search_quality(im, max_size, min_quality, max_quality)
+  return quality, data, encodes, time.perf_counter() - start
+
+def derive_all(project, force=False, min_quality=30, max_quality=90):
+  # returns the number of derivatives that failed
+  start = time.perf_counter()
+  hash_cache = project.hash_cache
+  manifest = BuildManifest(os.path.join(project.cache_dir, "derivative_manifest.json"))
+
+  # (key, source path, derivative path, spec)
+  candidates = []
+  for row in project.static_index:
+    resource_dir = os.path.join(project.product_dir(row["nanoid"]), "resource")
+    for name, source in derivative_sources.items():
+      source_path = os.path.join(resource_dir, source)
+      if os.path.isfile(source_path):
+        key = "{}/{}".format(row["nanoid"], name)
+        candidates.append((key, source_path, os.path.join(resource_dir, name), image_resource_specifications[name]))
+
+  source_multihashes = hash_cache.get_multihashes([c[1] for c in candidates], jobs=project.jobs)
+  settings = {"encoder_version": encoder_version, "min_quality": min_quality, "max_quality": max_quality}
+
+  pending = []
+  skipped = 0
+  for key, source_path, out_path, spec in candidates:
+    input_fingerprint = fingerprint({
+      "source": source_multihashes[source_path],
+      "width": spec["width"],
+      "height": spec["height"],
+      "max_size": spec["max_size"],
+      "settings": settings,
+    })
+    if not force and manifest.is_current(key, input_fingerprint, {"derivative": out_path}, hash_cache):
+      skipped += 1
+      continue
+    args = (source_path, int(spec["width"]), int(spec["height"]), spec["max_size"], min_quality, max_quality)
+    pending.append((key, input_fingerprint, out_path, args))
+
+  # yields (key, input fingerprint, derivative path, (quality, data, encodes, seconds) or the exception)
+  def derived():
+    if project.jobs > 1 and len(pending) > 1:
+      # deferred like in hash_cache, multiprocessing is slow to import and most runs skip everything
+      from concurrent.futures import ProcessPoolExecutor, as_completed
+      with ProcessPoolExecutor(max_workers=project.jobs) as executor:
+        futures = {executor.submit(derive, *p[3]): p for p in pending}
+        for future in as_completed(futures):
+          key, input_fingerprint, out_path, args = futures[future]
+          try:
+            yield key, input_fingerprint, out_path, future.result()
+          except Exception as e:
+            yield key, input_fingerprint, out_path, e
+    else:
+      for key, input_fingerprint, out_path, args in pending:
+        try:
+          yield key, input_fingerprint, out_path, derive(*args)
+        except Exception as e:
+          yield key, input_fingerprint, out_path, e
+
+  written = 0
+  failed = 0
+  for key, input_fingerprint, out_path, result in derived():
+    rel_path = os.path.relpath(out_path, project.root)
+    if isinstance(result, Exception):
+      print("Failed to derive {}: {}".format(rel_path, result))
+      failed += 1
+      continue
+    quality, data, encodes, seconds = result
+    project.profiler.record(key, seconds=seconds, encodes=encodes, written_bytes=len(data))
+    if write_if_changed(out_path, data):
+      written += 1
+    print("derived {}: quality {}, {:.0f} KB after {} encodes".format(rel_path, quality, len(data) / 1e3, encodes))
+    manifest.record(key, input_fingerprint, {"derivative": hash_cache.get_multihash(out_path)})
+  manifest.save()
+
+  print("derived {} images ({} rewritten) in {:.2f} seconds, skipped {} unchanged, {} failed".format(
+    len(pending) - failed, written, time.perf_counter() - start, skipped, failed))
+  return failed
+
+if __name__ == "__main__":
+  main()
@@ -1,15 +1,33 @@
-import pandas as pd
 import os
+import argparse
 from pathlib import Path
+from project import add_project_arguments, project_from_args
 
-tsv_path = "../index/index.csv"
-df = pd.read_csv(tsv_path, ",")
+def add_arguments(parser):
+  pass
 
-if __name__ == "__main__":
-  for index, row in df.iterrows():
-    path = "../static/{}".format(row["nanoid"])
+def run(project, args):
+  generate_folders(project)
+
+def generate_folders(project):
+  for row in project.static_index:
+    path = project.product_dir(row["nanoid"])
 
-    os.mkdir(path)
+    os.makedirs(path)
     Path(os.path.join(path, ".gitkeep")).touch()
     os.mkdir(os.path.join(path, "resource"))
     Path(os.path.join(path, "resource/.gitkeep")).touch()
+
+def main():
+  parser = argparse.ArgumentParser(description="Create the static/ folder of every product in the static index")
+  add_project_arguments(parser)
+  add_arguments(parser)
+  args = parser.parse_args()
+  project = project_from_args(args)
+  try:
+    run(project, args)
+  finally:
+    project.close()
+
+if __name__ == "__main__":
+  main()
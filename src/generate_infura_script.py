@@ -1,28 +1,96 @@
 import os
-import subprocess
+import shlex
+import argparse
+from project import add_project_arguments, project_from_args
+from pin_client import PinClient
+from pinning import PinLedger, ledger_path, collect_pin_candidates, batches, script_header, script_footer
 
 script_dir = os.path.dirname(os.path.realpath(__file__))
-static_dir = os.path.join(script_dir, "../static")
 
-def get_ipfs_multihash(file_path):
-  # requires that script caller has IPFS installed
-  result = subprocess.run(['ipfs', 'add', file_path, '--only-hash', '-q'], stdout=subprocess.PIPE)
-  return result.stdout.decode('utf-8').strip()
+infura_api = "https://ipfs.infura.io:5001"
 
+def add_arguments(parser):
+  parser.add_argument("--api", default=infura_api, help="IPFS HTTP API base URL")
+  parser.add_argument("--batch-size", type=int, default=16, help="files per add request")
+  parser.add_argument("--concurrency", type=int, default=4, help="number of requests run at once")
+  parser.add_argument("--ledger", help="CIDs already pinned, appended to by the script (default cache/infura_pinned.txt)")
+  parser.add_argument("--execute", action="store_true", help="pin through the API directly instead of writing a script")
+  parser.add_argument("--rate", type=float, help="with --execute, maximum API requests per second")
+  parser.add_argument("--retries", type=int, default=3, help="with --execute, retries per file")
+  parser.add_argument("--timeout", type=float, default=300, help="with --execute, socket timeout in seconds")
+  parser.add_argument("--auth", default=os.environ.get("IPFS_API_AUTH"), help="with --execute, user:password basic auth (default $IPFS_API_AUTH)")
 
-with open(os.path.join(script_dir, "infura_deploy_pins.sh"), 'w') as f:
-  f.write("#!/usr/bin/env bash\n\n")
+def run(project, args):
+  ledger = PinLedger(os.path.realpath(args.ledger or ledger_path("infura", project.cache_dir)))
+  if args.execute:
+    client = PinClient(args.api, concurrency=args.concurrency, rate=args.rate, retries=args.retries, timeout=args.timeout, auth=args.auth, ledger=ledger)
+    try:
+      errors = pin(project, ledger, client)
+    finally:
+      client.close()
+    print(client.summary())
+    if errors:
+      raise errors[0]
+  else:
+    write_script(project, ledger, args.api, args.batch_size, args.concurrency)
+
+def main():
+  parser = argparse.ArgumentParser(description="Pin every card_low.jpg to Infura, or generate a shell script that does")
+  add_project_arguments(parser)
+  add_arguments(parser)
+  args = parser.parse_args()
+  project = project_from_args(args)
+  try:
+    run(project, args)
+  finally:
+    project.close()
+
+def card_paths(static_dir):
+  file_paths = []
   for path, subdirs, files in os.walk(static_dir):
     for name in files:
       if name == "card_low.jpg":
-        abs_path = os.path.join(path, name)
-        
-        multihash = get_ipfs_multihash(abs_path)
+        file_paths.append(os.path.join(path, name))
+  return sorted(file_paths)
+
+def pin(project, ledger, client):
+  file_paths = card_paths(project.static_dir)
+  candidates = collect_pin_candidates(file_paths, project.hash_cache, ledger, jobs=project.jobs)
+  print("{} files, {} distinct CIDs to pin, {} already pinned".format(len(file_paths), len(candidates), len(ledger.pinned)))
+  pinned, errors = client.pin_all(candidates)
+  for multihash, file_path in candidates:
+    if file_path in client.timings:
+      seconds, attempts = client.timings[file_path]
+      project.profiler.record(os.path.relpath(file_path, project.root), kind="file",
+        seconds=seconds, attempts=attempts, sent_bytes=os.path.getsize(file_path))
+  return errors
+
+def write_script(project, ledger, api=infura_api, batch_size=16, concurrency=4):
+  file_paths = card_paths(project.static_dir)
+  candidates = collect_pin_candidates(file_paths, project.hash_cache, ledger, jobs=project.jobs)
+
+  with open(os.path.join(script_dir, "infura_deploy_pins.sh"), 'w') as f:
+    f.write(script_header(concurrency))
+    f.write("PINNED_LEDGER=${{PINNED_LEDGER:-{}}}\n".format(shlex.quote(ledger.path)))
+    f.write("mkdir -p \"$(dirname \"$PINNED_LEDGER\")\"\n\n")
+    for batch in batches(candidates, batch_size):
+      multihashes = [multihash for multihash, file_path in batch]
+      # one multipart add request for the whole batch, then a single pin/add for all of its CIDs
+      # the ledger only gets the CIDs once both requests succeeded
+      files = " ".join("-F {}".format(shlex.quote("file=@{}".format(file_path))) for multihash, file_path in batch)
+      args = "&".join("arg={}".format(multihash) for multihash in multihashes)
+      for multihash, file_path in batch:
+        f.write("# {} {}\n".format(multihash, file_path))
+      f.write("throttle\n")
+      f.write("{\n")
+      f.write("  curl -sSf -X POST {} \"{}/api/v0/add?pin=true\" > /dev/null &&\n".format(files, api))
+      f.write("  curl -sSf -X POST \"{}/api/v0/pin/add?{}\" > /dev/null &&\n".format(api, args))
+      f.write("  printf '%s\\n' {} >> \"$PINNED_LEDGER\"\n".format(" ".join(multihashes)))
+      f.write("} &\n\n")
+    f.write(script_footer())
 
-        c = "# {}\n".format(abs_path)
-        a = "curl -X POST -F \"file=@{}\" \"https://ipfs.infura.io:5001/api/v0/add?progress=true\"\n".format(abs_path)
-        l = "curl -X POST \"https://ipfs.infura.io:5001/api/v0/pin/add?arg={}&progress=true\"\n\n".format(multihash)
+  print("{} files, {} distinct CIDs to pin in {} batches, {} already pinned".format(
+    len(file_paths), len(candidates), (len(candidates) + batch_size - 1) // batch_size, len(ledger.pinned)))
 
-        f.write(c)
-        f.write(a)
-        f.write(l)
+if __name__ == "__main__":
+  main()
@@ -1,15 +1,56 @@
 import os
+import shlex
+import argparse
+from project import add_project_arguments, project_from_args
+from pinning import PinLedger, ledger_path, collect_pin_candidates, batches, script_header, script_footer
 
 script_dir = os.path.dirname(os.path.realpath(__file__))
-static_dir = os.path.join(script_dir, "../static")
 
-with open(os.path.join(script_dir, "ipfs_deploy_pins.sh"), 'w') as f:
-  f.write("#!/usr/bin/env bash\n\n")
+def add_arguments(parser):
+  parser.add_argument("--batch-size", type=int, default=64, help="files per ipfs add invocation")
+  parser.add_argument("--concurrency", type=int, default=4, help="default number of ipfs add invocations the script runs at once")
+  parser.add_argument("--ledger", help="CIDs already pinned, appended to by the script (default cache/ipfs_pinned.txt)")
+
+def run(project, args):
+  ledger = PinLedger(os.path.realpath(args.ledger or ledger_path("ipfs", project.cache_dir)))
+  write_script(project, ledger, args.batch_size, args.concurrency)
+
+def main():
+  parser = argparse.ArgumentParser(description="Generate a shell script pinning every static file to a local IPFS node")
+  add_project_arguments(parser)
+  add_arguments(parser)
+  args = parser.parse_args()
+  project = project_from_args(args)
+  try:
+    run(project, args)
+  finally:
+    project.close()
+
+def write_script(project, ledger, batch_size=64, concurrency=4):
+  static_dir = project.static_dir
+  file_paths = []
   for path, subdirs, files in os.walk(static_dir):
     for name in files:
       if name != ".gitkeep":
-        abs_path = os.path.join(path, name)
-        rel_path = os.path.relpath(abs_path, static_dir)
-        
-        line = "ipfs add {} --pin=true\n".format(rel_path)
-        f.write(line)
+        file_paths.append(os.path.join(path, name))
+  file_paths.sort()
+  candidates = collect_pin_candidates(file_paths, project.hash_cache, ledger, jobs=project.jobs)
+
+  # paths are relative to static/, run the script from there or set STATIC_DIR
+  with open(os.path.join(script_dir, "ipfs_deploy_pins.sh"), 'w') as f:
+    f.write(script_header(concurrency))
+    f.write("PINNED_LEDGER=${{PINNED_LEDGER:-{}}}\n".format(shlex.quote(ledger.path)))
+    f.write("mkdir -p \"$(dirname \"$PINNED_LEDGER\")\"\n")
+    f.write("cd \"${STATIC_DIR:-.}\" || exit 1\n\n")
+    for batch in batches(candidates, batch_size):
+      rel_paths = [shlex.quote(os.path.relpath(file_path, static_dir)) for multihash, file_path in batch]
+      f.write("throttle\n")
+      # -q prints the CID of each file once it's added and pinned
+      f.write("ipfs add -q --pin=true -- {} >> \"$PINNED_LEDGER\" &\n\n".format(" ".join(rel_paths)))
+    f.write(script_footer())
+
+  print("{} files, {} distinct CIDs to pin in {} batches, {} already pinned".format(
+    len(file_paths), len(candidates), (len(candidates) + batch_size - 1) // batch_size, len(ledger.pinned)))
+
+if __name__ == "__main__":
+  main()
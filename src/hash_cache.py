@@ -0,0 +1,105 @@
+import os
+import sqlite3
+from ipfs_multihash import get_ipfs_multihash
+
+script_dir = os.path.dirname(os.path.realpath(__file__))
+cache_dir = os.path.join(script_dir, "../cache")
+cache_db = os.path.join(cache_dir, "multihash.sqlite")
+
+# On-disk cache of IPFS multihashes keyed on the file path and its stat fingerprint.
+# A file is only rehashed when its size, mtime or inode changed since it was last seen,
+# or when verify is set, in which case every file is rehashed and stale entries are reported.
+class HashCache:
+  def __init__(self, db_path=cache_db, verify=False):
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    self.conn = sqlite3.connect(db_path)
+    self.conn.execute("""
+      CREATE TABLE IF NOT EXISTS multihash (
+        path TEXT PRIMARY KEY,
+        size INTEGER NOT NULL,
+        mtime_ns INTEGER NOT NULL,
+        inode INTEGER NOT NULL,
+        multihash TEXT NOT NULL
+      )
+    """)
+    self.verify = verify
+    self.hits = 0
+    self.misses = 0
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def close(self):
+    self.conn.commit()
+    self.conn.close()
+
+  def lookup(self, file_path):
+    # returns (key, fingerprint, cached multihash or None)
+    path = os.path.realpath(file_path)
+    st = os.stat(path)
+    fingerprint = (st.st_size, st.st_mtime_ns, st.st_ino)
+    row = self.conn.execute(
+      "SELECT size, mtime_ns, inode, multihash FROM multihash WHERE path = ?", (path,)
+    ).fetchone()
+    if row is not None and tuple(row[:3]) == fingerprint:
+      return path, fingerprint, row[3]
+    return path, fingerprint, None
+
+  def store(self, path, fingerprint, multihash):
+    self.conn.execute(
+      "INSERT OR REPLACE INTO multihash (path, size, mtime_ns, inode, multihash) VALUES (?, ?, ?, ?, ?)",
+      (path, fingerprint[0], fingerprint[1], fingerprint[2], multihash)
+    )
+
+  def get_multihash(self, file_path):
+    return self.get_multihashes([file_path])[file_path]
+
+  def record(self, file_path, multihash):
+    # for files whose multihash was computed elsewhere, e.g. while they were downloaded
+    path = os.path.realpath(file_path)
+    st = os.stat(path)
+    self.store(path, (st.st_size, st.st_mtime_ns, st.st_ino), multihash)
+
+  def move(self, old_dir, new_dir):
+    # carry entries over a directory rename, which keeps the inode and mtime of every file
+    old_dir = os.path.realpath(old_dir)
+    new_dir = os.path.realpath(new_dir)
+    prefix = old_dir + os.sep
+    self.conn.execute(
+      "UPDATE OR REPLACE multihash SET path = ? || substr(path, ?) WHERE substr(path, 1, ?) = ?",
+      (new_dir + os.sep, len(prefix) + 1, len(prefix), prefix)
+    )
+
+  def get_multihashes(self, file_paths, jobs=1):
+    # hash every cache miss across a process pool, returns {file_path: multihash}
+    multihashes = {}
+    pending = {}
+    for file_path in file_paths:
+      path, fingerprint, cached = self.lookup(file_path)
+      if cached is not None and not self.verify:
+        self.hits += 1
+        multihashes[file_path] = cached
+      else:
+        pending[file_path] = (path, fingerprint, cached)
+
+    if jobs > 1 and len(pending) > 1:
+      # deferred, multiprocessing is slow to import and most runs are cache hits
+      from concurrent.futures import ProcessPoolExecutor
+      with ProcessPoolExecutor(max_workers=jobs) as executor:
+        results = list(executor.map(get_ipfs_multihash, [p[0] for p in pending.values()]))
+    else:
+      results = [get_ipfs_multihash(p[0]) for p in pending.values()]
+
+    for (file_path, (path, fingerprint, cached)), multihash in zip(pending.items(), results):
+      self.misses += 1
+      if cached is not None and cached != multihash:
+        print("Warning: stale cached multihash for {}, {} != {}".format(path, cached, multihash))
+      self.store(path, fingerprint, multihash)
+      multihashes[file_path] = multihash
+    return multihashes
+
+  def summary(self):
+    return "hashed {} files, {} from cache".format(self.misses, self.hits)
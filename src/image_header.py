@@ -0,0 +1,74 @@
+import struct
+
+# Reads image dimensions straight from the PNG IHDR chunk or the JPEG SOF segment,
+# which only touches the first few KB of the file instead of setting up a decoder.
+
+png_signature = b'\x89PNG\r\n\x1a\n'
+
+# SOF markers carrying the frame size, i.e. every 0xC0-0xCF except DHT (C4), JPG (C8) and DAC (CC)
+jpeg_sof_markers = {0xc0, 0xc1, 0xc2, 0xc3, 0xc5, 0xc6, 0xc7, 0xc9, 0xca, 0xcb, 0xcd, 0xce, 0xcf}
+# markers without a length field
+jpeg_standalone_markers = {0x01, 0xd0, 0xd1, 0xd2, 0xd3, 0xd4, 0xd5, 0xd6, 0xd7, 0xd8}
+
+def read_png_size(f):
+  header = f.read(24)
+  if len(header) < 24 or header[:8] != png_signature or header[12:16] != b'IHDR':
+    return None
+  return struct.unpack('>II', header[16:24])
+
+def read_jpeg_size(f):
+  if f.read(2) != b'\xff\xd8':
+    return None
+  while True:
+    byte = f.read(1)
+    if not byte:
+      return None
+    if byte != b'\xff':
+      # not at a marker, the stream is corrupt or we lost sync
+      return None
+    marker = f.read(1)
+    # any number of 0xFF fill bytes may precede a marker
+    while marker == b'\xff':
+      marker = f.read(1)
+    if not marker:
+      return None
+    marker = marker[0]
+    if marker in jpeg_standalone_markers:
+      continue
+    if marker == 0xd9 or marker == 0xda:
+      # end of image or start of scan without a frame header
+      return None
+    length = f.read(2)
+    if len(length) < 2:
+      return None
+    length = struct.unpack('>H', length)[0]
+    if marker in jpeg_sof_markers:
+      segment = f.read(5)
+      if len(segment) < 5:
+        return None
+      height, width = struct.unpack('>HH', segment[1:5])
+      # a height of 0 means it is defined later by a DNL marker
+      if width == 0 or height == 0:
+        return None
+      return width, height
+    f.seek(length - 2, 1)
+
+def read_image_size(path):
+  # (width, height) from the file header, or None if the header can't be trusted
+  with open(path, 'rb') as f:
+    signature = f.read(8)
+    f.seek(0)
+    if signature == png_signature:
+      return read_png_size(f)
+    if signature[:2] == b'\xff\xd8':
+      return read_jpeg_size(f)
+  return None
+
+def image_size(path):
+  size = read_image_size(path)
+  if size is not None:
+    return size
+  # ambiguous or unknown header, let Pillow decide
+  from PIL import Image
+  with Image.open(path) as im:
+    return im.size
@@ -0,0 +1,116 @@
+import hashlib
+
+# Computes the same CIDv0 multihash as `ipfs add --only-hash -q` with the go-ipfs defaults:
+# - fixed size chunker of 256 KiB (size-262144)
+# - balanced DAG layout with at most 174 links per node
+# - leaves wrapped in UnixFS File nodes (no raw leaves, since CIDv0)
+
+chunk_size = 262144
+max_links = 174
+
+base58_alphabet = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+
+# UnixFS Data.DataType File
+unixfs_type_file = 2
+
+def encode_varint(n):
+  out = bytearray()
+  while n >= 0x80:
+    out.append((n & 0x7f) | 0x80)
+    n >>= 7
+  out.append(n)
+  return bytes(out)
+
+def encode_bytes_field(field_number, data):
+  return encode_varint(field_number << 3 | 2) + encode_varint(len(data)) + data
+
+def encode_varint_field(field_number, n):
+  return encode_varint(field_number << 3) + encode_varint(n)
+
+def base58_encode(data):
+  n = int.from_bytes(data, 'big')
+  out = []
+  while n > 0:
+    n, r = divmod(n, 58)
+    out.append(base58_alphabet[r])
+  # leading zero bytes are encoded as leading '1's
+  for b in data:
+    if b != 0:
+      break
+    out.append(base58_alphabet[0])
+  return ''.join(reversed(out))
+
+def sha256_multihash(block):
+  # multihash prefix: sha2-256 (0x12), 32 byte digest (0x20)
+  return b'\x12\x20' + hashlib.sha256(block).digest()
+
+def encode_leaf(data):
+  # UnixFS Data message, wrapped as the Data field of a PBNode without links
+  unixfs = encode_varint_field(1, unixfs_type_file)
+  if data:
+    unixfs += encode_bytes_field(2, data)
+  unixfs += encode_varint_field(3, len(data))
+  return encode_bytes_field(1, unixfs)
+
+def encode_parent(children):
+  # children are (multihash, tsize, filesize) tuples
+  # dag-pb canonical form writes Links (field 2) before Data (field 1)
+  block = b''
+  for multihash, tsize, _ in children:
+    link = encode_bytes_field(1, multihash) + encode_bytes_field(2, b'') + encode_varint_field(3, tsize)
+    block += encode_bytes_field(2, link)
+  unixfs = encode_varint_field(1, unixfs_type_file)
+  unixfs += encode_varint_field(3, sum(c[2] for c in children))
+  for _, _, filesize in children:
+    unixfs += encode_varint_field(4, filesize)
+  block += encode_bytes_field(1, unixfs)
+  return block
+
+class UnixfsHasher:
+  # Incremental CIDv0 builder, feed it bytes with update() and read multihash() at the end.
+  # Only the leaf digests are kept in memory, never the file contents.
+
+  def __init__(self):
+    self.buffer = bytearray()
+    self.leaves = []
+    self.size = 0
+
+  def update(self, data):
+    self.size += len(data)
+    self.buffer += data
+    while len(self.buffer) >= chunk_size:
+      self._add_leaf(bytes(self.buffer[:chunk_size]))
+      del self.buffer[:chunk_size]
+
+  def _add_leaf(self, data):
+    block = encode_leaf(data)
+    self.leaves.append((sha256_multihash(block), len(block), len(data)))
+
+  def digest(self):
+    nodes = list(self.leaves)
+    if self.buffer or not nodes:
+      block = encode_leaf(bytes(self.buffer))
+      nodes.append((sha256_multihash(block), len(block), len(self.buffer)))
+    # balanced layout, every level is packed left to right until a single root remains
+    while len(nodes) > 1:
+      parents = []
+      for i in range(0, len(nodes), max_links):
+        children = nodes[i:i + max_links]
+        block = encode_parent(children)
+        tsize = len(block) + sum(c[1] for c in children)
+        parents.append((sha256_multihash(block), tsize, sum(c[2] for c in children)))
+      nodes = parents
+    return nodes[0][0]
+
+  def multihash(self):
+    return base58_encode(self.digest())
+
+def get_ipfs_multihash(file_path):
+  hasher = UnixfsHasher()
+  with open(file_path, 'rb') as f:
+    while True:
+      data = f.read(chunk_size)
+      if not data:
+        break
+      hasher.update(data)
+  return hasher.multihash()
@@ -0,0 +1,87 @@
+import os
+import re
+import argparse
+from project import add_project_arguments, project_from_args, layouts, product_path
+
+def add_arguments(parser):
+  parser.add_argument("--layout", choices=layouts, required=True, help="layout to move static/ and the mirrors to")
+  parser.add_argument("--dry-run", action="store_true", help="only print the moves")
+
+def run(project, args):
+  migrate(project, args.layout, dry_run=args.dry_run)
+
+def main():
+  parser = argparse.ArgumentParser(description="Move static/ and the constructed mirrors between the flat and sharded layouts")
+  add_project_arguments(parser)
+  add_arguments(parser)
+  args = parser.parse_args()
+  project = project_from_args(args)
+  try:
+    run(project, args)
+  finally:
+    project.close()
+
+def set_config_value(cfg_yaml, key, value):
+  # rewrite the key's line in place so the rest of config.yaml, comments included, is kept as is
+  with open(cfg_yaml, 'r') as f:
+    lines = f.readlines()
+  line = "{}: {}\n".format(key, value)
+  pattern = re.compile(r"^{}\s*:".format(re.escape(key)))
+  for i, l in enumerate(lines):
+    if pattern.match(l):
+      lines[i] = line
+      break
+  else:
+    if lines and not lines[-1].endswith("\n"):
+      lines[-1] += "\n"
+    lines.append(line)
+  with open(cfg_yaml, 'w') as f:
+    f.writelines(lines)
+
+def relink(old_dir, new_dir):
+  # relative symlinks into the asset store break when a folder changes depth, point them at their target again
+  for path, subdirs, files in os.walk(new_dir):
+    for name in files:
+      link = os.path.join(path, name)
+      if not os.path.islink(link):
+        continue
+      old_link = os.path.join(old_dir, os.path.relpath(link, new_dir))
+      target = os.path.normpath(os.path.join(os.path.dirname(old_link), os.readlink(link)))
+      os.remove(link)
+      os.symlink(os.path.relpath(target, path), link)
+
+def migrate(project, layout, dry_run=False):
+  current = project.static_layout
+  trees = [project.static_dir] + list(project.mirror_dirs.values())
+  moved = 0
+  for tree in trees:
+    if not os.path.isdir(tree):
+      continue
+    for row in project.static_index:
+      old_dir = product_path(tree, row["nanoid"], current)
+      new_dir = product_path(tree, row["nanoid"], layout)
+      if old_dir == new_dir or not os.path.isdir(old_dir):
+        continue
+      if os.path.exists(new_dir):
+        raise ValueError("Can't move {} to {}, it already exists".format(old_dir, new_dir))
+      print("{} -> {}".format(os.path.relpath(old_dir, project.root), os.path.relpath(new_dir, project.root)))
+      moved += 1
+      if dry_run:
+        continue
+      os.makedirs(os.path.dirname(new_dir), exist_ok=True)
+      os.rename(old_dir, new_dir)
+      relink(old_dir, new_dir)
+      project.hash_cache.move(old_dir, new_dir)
+      # drop the shard folder once its last product left
+      old_parent = os.path.dirname(old_dir)
+      if old_parent != tree and not os.listdir(old_parent):
+        os.rmdir(old_parent)
+
+  print("{} {} product folders from the {} to the {} layout".format("would move" if dry_run else "moved", moved, current, layout))
+  if not dry_run and layout != current:
+    set_config_value(project.cfg_yaml, "static_layout", layout)
+    project.cfg["static_layout"] = layout
+    print("set static_layout: {} in {}".format(layout, project.cfg_yaml))
+
+if __name__ == "__main__":
+  main()
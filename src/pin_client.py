@@ -0,0 +1,182 @@
+import os
+import json
+import time
+import uuid
+import base64
+import threading
+import http.client
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from fetch import ConnectionPool, RetryableStatus, read_size, retry_statuses
+
+# Client for the IPFS HTTP API (/api/v0/add, /api/v0/pin/add) of Infura, a local node or a mock.
+# Files are streamed as multipart uploads from a bounded worker pool over keep-alive connections,
+# request starts are rate limited, and every pinned CID is appended to a PinLedger.
+
+class RateLimiter:
+  def __init__(self, rate=None):
+    # rate is the maximum number of requests started per second, None for no limit
+    self.interval = 1 / rate if rate else 0
+    self.next = 0
+    self.lock = threading.Lock()
+
+  def wait(self):
+    if not self.interval:
+      return
+    with self.lock:
+      now = time.monotonic()
+      start = max(now, self.next)
+      self.next = start + self.interval
+    if start > now:
+      time.sleep(start - now)
+
+class PinClient:
+  def __init__(self, api, concurrency=4, rate=None, retries=3, backoff=0.5, timeout=300, auth=None, ledger=None):
+    parsed = urllib.parse.urlsplit(api)
+    if parsed.scheme not in ("http", "https"):
+      raise ValueError("Unsupported IPFS API URL {}".format(api))
+    self.base_path = parsed.path.rstrip("/")
+    self.connections = ConnectionPool(parsed.scheme, parsed.netloc, timeout)
+    self.concurrency = concurrency
+    self.limiter = RateLimiter(rate)
+    self.retries = retries
+    self.backoff = backoff
+    self.headers = {}
+    if auth:
+      # Infura takes the project id and secret as basic auth
+      self.headers["Authorization"] = "Basic " + base64.b64encode(auth.encode()).decode()
+    self.ledger = ledger
+    self.lock = threading.Lock()
+    self.requests = 0
+    self.retried = 0
+    # file bytes of uploads that ended in a pin, each file counted once,
+    # and of attempts that failed and were sent again or given up on
+    self.bytes_sent = 0
+    self.bytes_retried = 0
+    # {file_path: (seconds, attempts)} of every pinned file, for per-file profiling
+    self.timings = {}
+    self.pinned = 0
+
+  def close(self):
+    self.connections.close()
+
+  def post(self, path, query, body=None, headers=None):
+    # returns the decoded JSON of the last line of the response
+    self.limiter.wait()
+    url = "{}/api/v0/{}?{}".format(self.base_path, path, urllib.parse.urlencode(query, doseq=True))
+    all_headers = dict(self.headers)
+    all_headers.update(headers or {})
+    if body is None:
+      all_headers["Content-Length"] = "0"
+    conn = self.connections.acquire()
+    try:
+      conn.request("POST", url, body=body, headers=all_headers)
+      resp = conn.getresponse()
+      data = resp.read()
+    except Exception:
+      conn.close()
+      raise
+    self.connections.release(conn)
+    with self.lock:
+      self.requests += 1
+
+    if resp.status in retry_statuses:
+      raise RetryableStatus("HTTP {}".format(resp.status))
+    if resp.status != 200:
+      raise ValueError("({}) HTTP {} {}: {}".format(path, resp.status, resp.reason, data[:200].decode(errors="replace")))
+    lines = [line for line in data.splitlines() if line.strip()]
+    if not lines:
+      raise ValueError("({}) Empty response".format(path))
+    return json.loads(lines[-1])
+
+  def multipart(self, file_path, streamed):
+    # (body iterable, headers) streaming file_path as the single part of a multipart/form-data body,
+    # streamed is a one item list the body adds the file bytes it sent to
+    boundary = uuid.uuid4().hex
+    head = "--{}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"{}\"\r\nContent-Type: application/octet-stream\r\n\r\n".format(
+      boundary, urllib.parse.quote(os.path.basename(file_path))).encode()
+    tail = "\r\n--{}--\r\n".format(boundary).encode()
+    size = os.path.getsize(file_path)
+
+    def body():
+      yield head
+      with open(file_path, 'rb') as f:
+        while True:
+          data = f.read(read_size)
+          if not data:
+            break
+          streamed[0] += len(data)
+          yield data
+      yield tail
+
+    headers = {
+      "Content-Type": "multipart/form-data; boundary={}".format(boundary),
+      "Content-Length": str(len(head) + size + len(tail)),
+    }
+    return body(), headers
+
+  def pin(self, multihash, file_path, streamed):
+    # upload file_path, check the API computed the CID we expect, then pin it
+    body, headers = self.multipart(file_path, streamed)
+    added = self.post("add", {"pin": "true", "cid-version": "0"}, body, headers)
+    if added.get("Hash") != multihash:
+      raise ValueError("({}) API added {}, expected {}".format(file_path, added.get("Hash"), multihash))
+    pinned = self.post("pin/add", {"arg": multihash})
+    if multihash not in pinned.get("Pins", []):
+      raise ValueError("({}) {} missing from pin/add response {}".format(file_path, multihash, pinned))
+    return multihash
+
+  def pin_with_retries(self, multihash, file_path):
+    start = time.perf_counter()
+    for attempt in range(self.retries + 1):
+      streamed = [0]
+      try:
+        self.pin(multihash, file_path, streamed)
+      except (OSError, http.client.HTTPException, RetryableStatus) as e:
+        with self.lock:
+          self.bytes_retried += streamed[0]
+        if attempt == self.retries:
+          raise ValueError("({}) Failed after {} attempts: {}".format(file_path, attempt + 1, e))
+        with self.lock:
+          self.retried += 1
+        time.sleep(self.backoff * 2 ** attempt)
+      except Exception:
+        with self.lock:
+          self.bytes_retried += streamed[0]
+        raise
+      else:
+        with self.lock:
+          self.bytes_sent += streamed[0]
+          self.timings[file_path] = (time.perf_counter() - start, attempt + 1)
+        return multihash
+
+  def pin_all(self, candidates):
+    # candidates are (multihash, file_path) pairs
+    # returns ([pinned multihashes], [errors of failed pins])
+    start = time.perf_counter()
+    pinned = []
+    errors = []
+    with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+      futures = {executor.submit(self.pin_with_retries, multihash, file_path): (multihash, file_path) for multihash, file_path in candidates}
+      for future in as_completed(futures):
+        multihash, file_path = futures[future]
+        try:
+          future.result()
+        except Exception as e:
+          print("Error: {}".format(e))
+          errors.append(e)
+          continue
+        pinned.append(multihash)
+        if self.ledger is not None:
+          self.ledger.add(multihash, file_path)
+        self.pinned += 1
+        elapsed = time.perf_counter() - start
+        print("Pinned {} {} ({}/{}, {:.2f} MB/s)".format(multihash, file_path, len(pinned), len(candidates), self.bytes_sent / 1e6 / max(elapsed, 1e-9)))
+    self.seconds = time.perf_counter() - start
+    return pinned, errors
+
+  def summary(self):
+    seconds = getattr(self, "seconds", 0)
+    return "pinned {} files, sent {} bytes in {} requests over {} connections in {:.2f}s ({:.2f} MB/s), {} retries, {} bytes sent by failed attempts".format(
+      self.pinned, self.bytes_sent, self.requests, self.connections.opened, seconds, self.bytes_sent / 1e6 / max(seconds, 1e-9),
+      self.retried, self.bytes_retried)
@@ -0,0 +1,63 @@
+import os
+
+script_dir = os.path.dirname(os.path.realpath(__file__))
+cache_dir = os.path.join(script_dir, "../cache")
+
+# Ledger of CIDs already pinned to a target, one CID per line optionally followed by other fields.
+# The generated shell scripts append the CIDs they pinned, so reruns only pin what's new.
+class PinLedger:
+  def __init__(self, path):
+    self.path = path
+    self.pinned = set()
+    if os.path.exists(path):
+      with open(path, 'r') as f:
+        for line in f:
+          fields = line.split()
+          if fields:
+            self.pinned.add(fields[0])
+
+  def __contains__(self, multihash):
+    return multihash in self.pinned
+
+  def add(self, multihash, *fields):
+    os.makedirs(os.path.dirname(self.path), exist_ok=True)
+    with open(self.path, 'a') as f:
+      f.write(" ".join([multihash] + [str(x) for x in fields]) + "\n")
+    self.pinned.add(multihash)
+
+def ledger_path(target, cache_dir=cache_dir):
+  return os.path.join(cache_dir, "{}_pinned.txt".format(target))
+
+def collect_pin_candidates(file_paths, hash_cache, ledger, jobs=1):
+  # [(multihash, file_path)] with one file per distinct multihash, skipping CIDs the ledger has
+  multihashes = hash_cache.get_multihashes(file_paths, jobs=jobs)
+  candidates = {}
+  for file_path in file_paths:
+    multihash = multihashes[file_path]
+    if multihash in ledger or multihash in candidates:
+      continue
+    candidates[multihash] = file_path
+  return [(multihash, file_path) for multihash, file_path in candidates.items()]
+
+def batches(items, size):
+  for i in range(0, len(items), size):
+    yield items[i:i + size]
+
+def script_header(jobs):
+  # bash helper running at most $JOBS batches at once in the background
+  return "\n".join([
+    "#!/usr/bin/env bash",
+    "",
+    "JOBS=${{JOBS:-{}}}".format(jobs),
+    "",
+    "throttle() {",
+    "  while [ \"$(jobs -rp | wc -l)\" -ge \"$JOBS\" ]; do",
+    "    wait -n",
+    "  done",
+    "}",
+    "",
+    "",
+  ])
+
+def script_footer():
+  return "wait\n"
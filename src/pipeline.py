@@ -0,0 +1,72 @@
+import sys
+import argparse
+import importlib
+from project import add_project_arguments, project_from_args
+
+# One entry point chaining the scripts in src/ as steps of a single process, e.g.
+#   python pipeline.py --jobs 8 build --incremental bundle validate --strict
+# The steps share one Project, so config, index and hash cache are loaded once,
+# and documents written by build are handed to bundle and mirror from memory.
+
+# step name: (module, description), modules are imported when their step runs
+steps = {
+  "folders": ("generate_folders", "create the static/ folder of every product in the static index"),
+  "derive": ("generate_derivatives", "derive card_low.jpg and artwork_low.jpg from the PNGs of every product"),
+  "build": ("generate_database", "generate database CSVs and Novellia metadata from static assets"),
+  "bundle": ("bundle_metadata", "copy the on-chain metadata of every product to metadata/, or pack it into mint transactions"),
+  "mirror": ("construct_static", "mirror and verify every resource from the CDN, IPFS and Sia"),
+  "size": ("tx_metadata", "report the CBOR size of the on-chain metadata in mint transactions"),
+  "validate": ("validate_resources", "validate the original and mirrored static trees"),
+  "pin": ("generate_infura_script", "pin card_low.jpg files through an IPFS HTTP API, or generate a script that does"),
+  "migrate": ("migrate_static", "move static/ and the mirrors between the flat and sharded layouts"),
+}
+
+def split_steps(argv):
+  # ([global arguments], [(step, [step arguments])]), every argument equal to a step name starts a new step
+  global_argv = []
+  chain = []
+  for arg in argv:
+    if arg in steps:
+      chain.append((arg, []))
+    elif chain:
+      chain[-1][1].append(arg)
+    else:
+      global_argv.append(arg)
+  return global_argv, chain
+
+def main(argv=None):
+  argv = sys.argv[1:] if argv is None else argv
+  global_argv, chain = split_steps(argv)
+
+  parser = argparse.ArgumentParser(
+    description="Run one or more token-assets steps in a single process",
+    usage="%(prog)s [--root ROOT] [--verify-hashes] [--jobs JOBS] [--profile [TRACE]] STEP [STEP OPTIONS] [STEP [STEP OPTIONS] ...]",
+    epilog="steps: " + "; ".join("{} - {}".format(name, description) for name, (module, description) in steps.items()),
+  )
+  add_project_arguments(parser)
+  args = parser.parse_args(global_argv)
+  if not chain:
+    parser.error("expected at least one step out of {}".format(", ".join(steps)))
+
+  # parse every step's arguments before running anything, so a typo fails fast
+  planned = []
+  for name, step_argv in chain:
+    module = importlib.import_module(steps[name][0])
+    step_parser = argparse.ArgumentParser(prog="{} {}".format(parser.prog, name), description=steps[name][1])
+    module.add_arguments(step_parser)
+    planned.append((name, module, step_parser.parse_args(step_argv)))
+
+  project = project_from_args(args)
+  failed = 0
+  try:
+    for name, module, step_args in planned:
+      print("== {}".format(name))
+      with project.profiler.stage(name):
+        failed += module.run(project, step_args) or 0
+  finally:
+    project.close()
+  if failed:
+    sys.exit(1)
+
+if __name__ == "__main__":
+  main()
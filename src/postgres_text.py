@@ -0,0 +1,45 @@
+# Postgres array literals for the text columns of the database CSVs and COPY streams.
+# Elements are quoted exactly when Postgres' own array output would quote them, i.e. when they are
+# empty, spell NULL, or contain braces, commas, quotes, backslashes or whitespace.
+# Nested lists become nested arrays, None and NaN become NULL elements.
+import itertools
+
+# the elements that are quoted whatever their characters, "" and NULL in any case
+null_spellings = frozenset(["".join(c) for c in itertools.product(*zip("null", "NULL"))] + [""])
+
+def needs_quotes(text):
+  # Postgres' scanner_isspace whitespace, braces, comma, quote and backslash, as chained
+  # substring tests, which are several times faster than a regex or a loop on short strings
+  return ("," in text or "{" in text or "}" in text or '"' in text or "\\" in text or " " in text
+    or "\t" in text or "\n" in text or "\r" in text or "\v" in text or "\f" in text)
+
+def is_null(value):
+  return value is None or (isinstance(value, float) and value != value)
+
+def encode_array_element(value):
+  if is_null(value):
+    return "NULL"
+  if isinstance(value, (list, tuple)):
+    return encode_array(value)
+  text = str(value)
+  if text.upper() == "NULL" or text == "" or needs_quotes(text):
+    return '"' + text.replace("\\", "\\\\").replace('"', '\\"') + '"'
+  return text
+
+def encode_array(values):
+  # e.g. ["a", "b c", None] -> {a,"b c",NULL}
+  # fast path for the usual lists of strings that need no quoting, checked with one scan of their
+  # concatenation and one set lookup per element
+  if type(values) is list:
+    try:
+      text = "".join(values)
+    except TypeError:
+      # NULLs, numbers or nested arrays
+      text = None
+    if text is not None and not needs_quotes(text) and null_spellings.isdisjoint(values):
+      return "{" + ",".join(values) + "}"
+  if is_null(values):
+    return None
+  if isinstance(values, str):
+    raise ValueError("Expected a list of array elements, got the string {!r}".format(values))
+  return "{" + ",".join([encode_array_element(v) for v in values]) + "}"
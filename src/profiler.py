@@ -0,0 +1,210 @@
+import os
+import sys
+import json
+import time
+import threading
+
+# Opt-in instrumentation shared by every script through Project.profiler, enabled with --profile.
+# A span records wall and CPU time, bytes read and written, processes forked and peak RSS.
+# Spans nest: the whole run, each pipeline step as a stage, and each product a stage loops over.
+# The spans are written as a JSON tree at the end of the run, and --cprofile also dumps pstats.
+#
+# Bytes are read/write syscalls from /proc/self/io, so they include downloads, and like CPU time
+# they include pool workers once those exited. Peak RSS is this process' own, per span where
+# /proc/self/clear_refs can reset it, otherwise the peak so far. Bytes are left out off Linux.
+# Forks are counted by a fork hook, so they're pool workers and not a subprocess count,
+# subprocess.Popen forks and execs in C without running fork hooks.
+
+# bump when the layout of the trace changes
+trace_version = 3
+
+# processes forked by this one, e.g. hash_cache and generate_derivatives pool workers
+forks = 0
+forks_lock = threading.Lock()
+counting_forks = False
+
+def count_fork():
+  global forks
+  # runs in whichever thread forked
+  with forks_lock:
+    forks += 1
+
+def start_counting_forks():
+  global counting_forks
+  if not counting_forks:
+    os.register_at_fork(after_in_parent=count_fork)
+    counting_forks = True
+
+def read_io():
+  # (bytes read, bytes written) by this process so far, None where /proc/self/io doesn't exist
+  try:
+    with open("/proc/self/io", 'r') as f:
+      counters = dict(line.split(": ") for line in f.read().splitlines())
+    return int(counters["rchar"]), int(counters["wchar"])
+  except (OSError, KeyError, ValueError):
+    return None
+
+def read_peak_rss():
+  # peak resident set size in bytes, since the last reset where supported
+  try:
+    with open("/proc/self/status", 'r') as f:
+      for line in f:
+        if line.startswith("VmHWM:"):
+          return int(line.split()[1]) * 1024
+  except OSError:
+    pass
+  import resource
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  # kilobytes on Linux, bytes on macOS
+  return peak if sys.platform == "darwin" else peak * 1024
+
+def reset_peak_rss():
+  try:
+    with open("/proc/self/clear_refs", 'w') as f:
+      f.write("5")
+    return True
+  except OSError:
+    return False
+
+class Span:
+  def __init__(self, name, kind):
+    self.name = name
+    self.kind = kind
+    self.children = []
+    self.peak_rss = 0
+    self.start_time = time.perf_counter()
+    self.start_cpu = os.times()
+    self.start_io = read_io()
+    self.start_forks = forks
+
+  def finish(self):
+    cpu = os.times()
+    io = read_io()
+    self.record = {
+      "name": self.name,
+      "kind": self.kind,
+      "seconds": time.perf_counter() - self.start_time,
+      # children's CPU time is only counted once they have been waited for, e.g. a pool was shut down
+      "cpu_seconds": sum(cpu[:4]) - sum(self.start_cpu[:4]),
+      "forks": forks - self.start_forks,
+      "peak_rss_bytes": self.peak_rss,
+    }
+    if io is not None and self.start_io is not None:
+      self.record["read_bytes"] = io[0] - self.start_io[0]
+      self.record["written_bytes"] = io[1] - self.start_io[1]
+    if self.children:
+      self.record["spans"] = [child.record for child in self.children]
+    return self.record
+
+class Profiler:
+  def __init__(self, trace_path=None, cprofile_path=None, name="run"):
+    self.trace_path = trace_path
+    self.cprofile_path = cprofile_path
+    self.enabled = trace_path is not None
+    self.stack = []
+    self.cprofile = None
+    if self.enabled:
+      start_counting_forks()
+      self.peak_rss_per_span = reset_peak_rss()
+      self.start_span(name, "run")
+    if cprofile_path is not None:
+      import cProfile
+      self.cprofile = cProfile.Profile()
+      self.cprofile.enable()
+
+  def start_span(self, name, kind):
+    if self.stack:
+      # fold the parent's peak so far in before the reset hides it
+      self.stack[-1].peak_rss = max(self.stack[-1].peak_rss, read_peak_rss())
+      if self.peak_rss_per_span:
+        reset_peak_rss()
+    self.stack.append(Span(name, kind))
+
+  def end_span(self):
+    span = self.stack.pop()
+    span.peak_rss = max(span.peak_rss, read_peak_rss())
+    span.finish()
+    if self.stack:
+      self.stack[-1].children.append(span)
+      self.stack[-1].peak_rss = max(self.stack[-1].peak_rss, span.peak_rss)
+    return span
+
+  def stage(self, name):
+    # context manager around one step of a run
+    return StageContext(self, name)
+
+  def product(self, name):
+    # starts the span of the product a stage loop is now working on, ending the previous one,
+    # None ends the last product once the loop is done. Used as a lap so loops need no reindenting.
+    if not self.enabled:
+      return
+    if self.stack[-1].kind == "product":
+      self.end_span()
+    if name is not None:
+      self.start_span(name, "product")
+
+  def record(self, name, kind="product", **metrics):
+    # adds a span measured elsewhere, e.g. a product processed in a pool worker
+    if self.enabled:
+      self.stack[-1].children.append(Recorded(dict(name=name, kind=kind, **metrics)))
+
+  def close(self):
+    if self.cprofile is not None:
+      self.cprofile.disable()
+      os.makedirs(os.path.dirname(os.path.abspath(self.cprofile_path)), exist_ok=True)
+      self.cprofile.dump_stats(self.cprofile_path)
+      print("wrote cProfile stats to {}".format(self.cprofile_path))
+      self.cprofile = None
+    if not self.enabled or not self.stack:
+      return
+    while len(self.stack) > 1:
+      self.end_span()
+    root = self.end_span()
+    trace = {
+      "version": trace_version,
+      "argv": sys.argv,
+      "started": time.strftime("%Y-%m-%dT%H:%M:%S%z", time.localtime(time.time() - root.record["seconds"])),
+      "peak_rss_per_span": self.peak_rss_per_span,
+      "run": root.record,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(self.trace_path)), exist_ok=True)
+    with open(self.trace_path, 'w') as f:
+      json.dump(trace, f, indent=2)
+    print(summary(root.record))
+    print("wrote profile trace to {}".format(self.trace_path))
+
+class StageContext:
+  def __init__(self, profiler, name):
+    self.profiler = profiler
+    self.name = name
+
+  def __enter__(self):
+    if self.profiler.enabled:
+      self.profiler.start_span(self.name, "stage")
+
+  def __exit__(self, *args):
+    if self.profiler.enabled:
+      # a product lap still open when the stage ends belongs to it
+      self.profiler.product(None)
+      self.profiler.end_span()
+
+class Recorded:
+  def __init__(self, record):
+    self.record = record
+    self.peak_rss = record.get("peak_rss_bytes", 0)
+
+def summary(run):
+  # one line per stage, with the product (or file) that took longest
+  lines = ["{:<24} {:>9} {:>9} {:>10} {:>10} {:>6} {:>9} {:>9}  {}".format(
+    "stage", "seconds", "cpu", "MB read", "MB written", "forks", "peak MB", "items", "slowest item")]
+  stages = [s for s in run.get("spans", []) if s["kind"] == "stage"] or [run]
+  for s in stages + ([run] if stages[0] is not run else []):
+    products = [p for p in s.get("spans", []) if p["kind"] in ("product", "file")]
+    slowest = max(products, key=lambda p: p["seconds"]) if products else None
+    lines.append("{:<24} {:>9.3f} {:>9.3f} {:>10} {:>10} {:>6} {:>9.1f} {:>9}  {}".format(
+      s["name"], s["seconds"], s.get("cpu_seconds", 0),
+      "{:.1f}".format(s["read_bytes"] / 1e6) if "read_bytes" in s else "-",
+      "{:.1f}".format(s["written_bytes"] / 1e6) if "written_bytes" in s else "-",
+      s.get("forks", 0), s.get("peak_rss_bytes", 0) / 1e6, len(products),
+      "{} {:.3f}s".format(slowest["name"], slowest["seconds"]) if slowest else ""))
+  return "\n".join(lines)
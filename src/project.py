@@ -0,0 +1,131 @@
+import os
+import sys
+import json
+from static_index import load_static_index
+from profiler import Profiler
+
+script_dir = os.path.dirname(os.path.realpath(__file__))
+default_root = os.path.join(script_dir, "..")
+
+# static_layout in config.yaml, how product folders are laid out in static/ and the mirrors
+#   flat:    static/<nanoid>/
+#   sharded: static/<first shard_length characters of nanoid>/<nanoid>/, for catalogs too big for one directory
+# static_urls picks the URL shape independently, flat keeps the 60 character
+# <static_host>/<nanoid>/nvla.json URLs of the README, and a sharded tree is served under them by the host
+layouts = ["flat", "sharded"]
+shard_length = 2
+
+def product_path(tree, nanoid, layout="flat"):
+  if layout not in layouts:
+    raise ValueError("Unknown static layout {}, expected one of {}".format(layout, layouts))
+  if layout == "sharded":
+    return os.path.join(tree, nanoid[:shard_length], nanoid)
+  return os.path.join(tree, nanoid)
+
+# Paths, config and index of a token-assets checkout, each loaded at most once per process.
+# Steps of one pipeline run share it, so e.g. the onchain.json documents a build produced
+# are handed to bundle and mirror from memory instead of being parsed back from static/.
+class Project:
+  def __init__(self, root=default_root, verify_hashes=False, jobs=None, profile=None, cprofile=None):
+    self.root = os.path.realpath(root)
+    self.verify_hashes = verify_hashes
+    self.jobs = jobs or os.cpu_count()
+
+    self.static_dir = os.path.join(self.root, "static")
+    self.data_dir = os.path.join(self.root, "data")
+    self.out_dir = os.path.join(self.root, "out")
+    self.metadata_dir = os.path.join(self.root, "metadata")
+    self.cache_dir = os.path.join(self.root, "cache")
+    self.cas_dir = os.path.join(self.root, "cas")
+    self.cfg_yaml = os.path.join(self.root, "config", "config.yaml")
+    self.index_csv = os.path.join(self.root, "index", "index.csv")
+    self.mirror_dirs = {
+      "cdn": os.path.join(self.root, "constructed_cdn_static"),
+      "ipfs": os.path.join(self.root, "constructed_ipfs_static"),
+      "sia": os.path.join(self.root, "constructed_sia_static"),
+    }
+
+    self._cfg = None
+    self._static_index = None
+    self._hash_cache = None
+    # {(nanoid, "nvla.json" or "onchain.json"): document} written or read during this run
+    self.artifacts = {}
+
+    # --profile with no path writes the trace to cache/profile.json
+    if profile == "":
+      profile = os.path.join(self.cache_dir, "profile.json")
+    script = os.path.splitext(os.path.basename(sys.argv[0]))[0] or "run"
+    self.profiler = Profiler(profile, cprofile, name=script)
+
+  @property
+  def cfg(self):
+    if self._cfg is None:
+      import yaml
+      print("reading export config from {}".format(self.cfg_yaml))
+      with open(self.cfg_yaml, 'r') as cfg_file:
+        self._cfg = yaml.full_load(cfg_file)
+    return self._cfg
+
+  @property
+  def static_layout(self):
+    return self.cfg.get("static_layout") or "flat"
+
+  @property
+  def static_urls(self):
+    return self.cfg.get("static_urls") or "flat"
+
+  def product_dir(self, nanoid, tree=None):
+    # folder of a product in static/, or in tree (e.g. a mirror) when given
+    return product_path(tree or self.static_dir, nanoid, self.static_layout)
+
+  def product_url(self, nanoid):
+    url_path = product_path("", nanoid, self.static_urls).replace(os.sep, "/")
+    return "{}/{}".format(self.cfg["static_host"], url_path)
+
+  @property
+  def static_index(self):
+    if self._static_index is None:
+      self._static_index = load_static_index(self.index_csv)
+    return self._static_index
+
+  @property
+  def hash_cache(self):
+    if self._hash_cache is None:
+      from hash_cache import HashCache
+      self._hash_cache = HashCache(os.path.join(self.cache_dir, "multihash.sqlite"), verify=self.verify_hashes)
+    return self._hash_cache
+
+  def artifact_path(self, nanoid, name):
+    return os.path.join(self.product_dir(nanoid), name)
+
+  def set_artifact(self, nanoid, name, document):
+    self.artifacts[(nanoid, name)] = document
+
+  def artifact(self, nanoid, name):
+    # the document built in this run, else the one on disk, None if there is neither
+    key = (nanoid, name)
+    if key not in self.artifacts:
+      try:
+        with open(self.artifact_path(nanoid, name), 'r') as f:
+          self.artifacts[key] = json.load(f)
+      except FileNotFoundError:
+        return None
+    return self.artifacts[key]
+
+  def close(self):
+    if self._hash_cache is not None:
+      print(self._hash_cache.summary())
+      self._hash_cache.close()
+      self._hash_cache = None
+    self.profiler.close()
+
+def add_project_arguments(parser):
+  parser.add_argument("--root", default=default_root, help="token-assets checkout to work on")
+  parser.add_argument("--verify-hashes", action="store_true", help="rehash every file and check the hash cache against it")
+  parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="number of parallel workers")
+  parser.add_argument("--profile", nargs="?", const="", metavar="TRACE",
+    help="record time, I/O, forks and peak RSS per stage and product to a JSON trace, cache/profile.json by default")
+  parser.add_argument("--cprofile", metavar="PSTATS", help="also dump cProfile stats of the run to this file")
+
+def project_from_args(args):
+  return Project(args.root, verify_hashes=args.verify_hashes, jobs=args.jobs, profile=args.profile, cprofile=args.cprofile)
@@ -0,0 +1,49 @@
+import os
+import csv
+
+script_dir = os.path.dirname(os.path.realpath(__file__))
+index_dir = os.path.join(script_dir, "../index")
+static_csv = os.path.join(index_dir, "index.csv")
+
+# index/index.csv loaded once and keyed by product_id, so joins don't rescan the index per product.
+class StaticIndex:
+  def __init__(self, rows, source=static_csv):
+    self.rows = rows
+    self.source = source
+    self.by_product_id = {}
+    nanoids = set()
+    for row in rows:
+      if row["product_id"] in self.by_product_id:
+        raise ValueError("Duplicate product_id {} in static index {}".format(row["product_id"], source))
+      if row["nanoid"] in nanoids:
+        raise ValueError("Duplicate nanoid {} in static index {}".format(row["nanoid"], source))
+      self.by_product_id[row["product_id"]] = row
+      nanoids.add(row["nanoid"])
+
+  def __iter__(self):
+    return iter(self.rows)
+
+  def __len__(self):
+    return len(self.rows)
+
+  def __contains__(self, product_id):
+    return product_id in self.by_product_id
+
+  def get(self, product_id):
+    try:
+      return self.by_product_id[product_id]
+    except KeyError:
+      raise ValueError("product_id {} not found in static index {}".format(product_id, self.source))
+
+  def nanoid(self, product_id):
+    return self.get(product_id)["nanoid"]
+
+def load_static_index(path=static_csv):
+  print("reading static serving index from {}".format(path))
+  # plain csv rather than pandas, the index is three string columns and importing pandas
+  # would dominate the startup of the small tools that only need to iterate it
+  with open(path, 'r', newline='') as f:
+    rows = list(csv.DictReader(f))
+  static_index = StaticIndex(rows, source=path)
+  print("loaded {} static index entries".format(len(static_index)))
+  return static_index
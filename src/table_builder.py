@@ -0,0 +1,47 @@
+import pandas as pd
+
+# Accumulates rows as plain dicts and materializes the DataFrame once at the end.
+# Growing a DataFrame with append copies the whole frame for every row.
+# Whole frames of rows computed with column operations can be added with extend,
+# rows and frames keep the order they were added in.
+class TableBuilder:
+  def __init__(self, columns):
+    self.columns = columns
+    self.column_set = set(columns)
+    self.rows = []
+    self.chunks = []
+    self.length = 0
+
+  def __len__(self):
+    return self.length
+
+  def check_columns(self, columns):
+    unknown = set(columns) - self.column_set
+    if unknown:
+      raise ValueError("Unknown columns {} for table with columns {}".format(sorted(unknown), self.columns))
+
+  def append(self, row):
+    self.check_columns(row)
+    # copy so later changes to the caller's dict don't leak into the table
+    self.rows.append(dict(row))
+    self.length += 1
+
+  def extend(self, df):
+    self.check_columns(df.columns)
+    self.flush()
+    self.chunks.append(df.reset_index(drop=True).reindex(columns=self.columns).astype(object))
+    self.length += len(df)
+
+  def flush(self):
+    if self.rows:
+      self.chunks.append(pd.DataFrame(self.rows, columns=self.columns, dtype=object))
+      self.rows = []
+
+  def to_df(self):
+    # object dtype keeps values exactly as added, e.g. ints stay ints next to missing values
+    self.flush()
+    if not self.chunks:
+      return pd.DataFrame(columns=self.columns, dtype=object)
+    if len(self.chunks) == 1:
+      return self.chunks[0]
+    return pd.concat(self.chunks, ignore_index=True)
@@ -0,0 +1,279 @@
+import sys
+import json
+import numbers
+import argparse
+from project import add_project_arguments, project_from_args
+
+# Cardano transaction metadata as CBOR, to measure what the onchain.json documents cost in a mint transaction.
+# Metadata is built from maps, lists, integers, byte strings and text strings, and no string may be
+# longer than 64 bytes once UTF-8 encoded, so longer text is split into a list of chunks as CIP-25 does.
+# Maps and lists use definite lengths, as cardano-cli writes them, so the sizes are exact.
+#
+# The size report also measures a compact layout that moves the fields every asset of a policy shares
+# (e.g. description and tags) up into the policy's map, so a transaction minting many assets carries
+# them once. It's a measurement only: CIP-25 readers take every key of a policy's map for an asset name,
+# so the hoisted fields would read as phantom assets, and nothing writes compact metadata to mint with.
+# pack() bins the assets of many documents into as few standard mint transactions as their sizes allow.
+
+max_string_bytes = 64
+
+# maxTxSize protocol parameter, the limit on a whole transaction in bytes
+max_tx_bytes = 16384
+
+# bytes of a mint transaction besides metadata and the assets' own entries, i.e. an input,
+# change and token outputs, fee, the policy script and two witnesses, with room to spare
+tx_overhead_bytes = 2048
+
+# top-level metadata label of CIP-25 NFT metadata
+nft_label = "721"
+
+def encode_head(major, n):
+  if n < 24:
+    return bytes([major << 5 | n])
+  if n < 0x100:
+    return bytes([major << 5 | 24, n])
+  if n < 0x10000:
+    return bytes([major << 5 | 25]) + n.to_bytes(2, 'big')
+  if n < 0x100000000:
+    return bytes([major << 5 | 26]) + n.to_bytes(4, 'big')
+  if n < 0x10000000000000000:
+    return bytes([major << 5 | 27]) + n.to_bytes(8, 'big')
+  raise ValueError("Integer {} doesn't fit in 64 bits".format(n))
+
+def encode_value(value, path, out):
+  # appends the CBOR of value to the bytearray out, path names the value in errors
+  if isinstance(value, bool) or value is None or not isinstance(value, (numbers.Integral, str, bytes, list, tuple, dict)):
+    raise ValueError("Can't encode {!r} at {} as transaction metadata, only maps, lists, integers and strings".format(value, path))
+  if isinstance(value, numbers.Integral):
+    value = int(value)
+    if not -0x10000000000000000 <= value < 0x10000000000000000:
+      raise ValueError("Integer {} at {} doesn't fit in the 64 bits transaction metadata allows".format(value, path))
+    out += encode_head(0, value) if value >= 0 else encode_head(1, -1 - value)
+  elif isinstance(value, (str, bytes)):
+    data = value.encode('utf-8') if isinstance(value, str) else value
+    if len(data) > max_string_bytes:
+      raise ValueError("{} is {} bytes, longer than the {} bytes transaction metadata allows, split it with chunk_long_strings".format(
+        path, len(data), max_string_bytes))
+    out += encode_head(3 if isinstance(value, str) else 2, len(data))
+    out += data
+  elif isinstance(value, dict):
+    out += encode_head(5, len(value))
+    for k, v in value.items():
+      encode_value(k, "{} key".format(path), out)
+      encode_value(v, "{}.{}".format(path, k), out)
+  else:
+    out += encode_head(4, len(value))
+    for i, v in enumerate(value):
+      encode_value(v, "{}[{}]".format(path, i), out)
+
+def encode(value, path="metadata"):
+  out = bytearray()
+  encode_value(value, path, out)
+  return bytes(out)
+
+def encode_metadata(document):
+  # the transaction metadata of an onchain.json document, whose top-level keys are integer labels
+  out = bytearray(encode_head(5, len(document)))
+  for label, value in document.items():
+    if not str(label).isdigit():
+      raise ValueError("Transaction metadata labels are unsigned integers, got {!r}".format(label))
+    encode_value(int(label), "label", out)
+    encode_value(value, str(label), out)
+  return bytes(out)
+
+def chunk_string(text):
+  # splits text into pieces of at most max_string_bytes, never inside a UTF-8 sequence
+  data = text.encode('utf-8')
+  chunks = []
+  start = 0
+  while start < len(data):
+    end = min(start + max_string_bytes, len(data))
+    while end < len(data) and data[end] & 0xc0 == 0x80:
+      end -= 1
+    chunks.append(data[start:end].decode('utf-8'))
+    start = end
+  return chunks
+
+def chunk_long_strings(value):
+  # value with every string longer than max_string_bytes replaced by the list of its chunks
+  if isinstance(value, str):
+    return chunk_string(value) if len(value.encode('utf-8')) > max_string_bytes else value
+  if isinstance(value, dict):
+    return {k: chunk_long_strings(v) for k, v in value.items()}
+  if isinstance(value, (list, tuple)):
+    return [chunk_long_strings(v) for v in value]
+  return value
+
+def is_policy_id(key):
+  # policy ids are the hex of a 28 byte script hash, other 721 keys are fields like copyright
+  return len(key) == 56 and all(c in "0123456789abcdef" for c in key.lower())
+
+def policies(document):
+  # {policy_id: {asset_id: asset}}
+  return {k: v for k, v in document[nft_label].items() if is_policy_id(k)}
+
+def shared_fields(document):
+  # the 721 entries that aren't policies, e.g. copyright and publisher
+  return {k: v for k, v in document[nft_label].items() if not is_policy_id(k)}
+
+def merge(documents):
+  # one document minting the assets of all documents, which must agree on their shared fields
+  shared = None
+  merged = {}
+  for document in documents:
+    if shared is None:
+      shared = shared_fields(document)
+    elif shared_fields(document) != shared:
+      raise ValueError("Can't merge metadata with different shared fields, {} != {}".format(shared_fields(document), shared))
+    for policy_id, assets in policies(document).items():
+      for asset_id, asset in assets.items():
+        if asset_id in merged.setdefault(policy_id, {}):
+          raise ValueError("Asset {} of policy {} appears twice".format(asset_id, policy_id))
+        merged[policy_id][asset_id] = asset
+  return {nft_label: dict(shared or {}, **merged)}
+
+def compact(document):
+  # document with the fields all assets of a policy share hoisted into the policy's map, for the
+  # size report only, returns (document, {policy_id: {hoisted field: value}})
+  compacted = dict(shared_fields(document))
+  hoisted = {}
+  for policy_id, policy in policies(document).items():
+    assets = list(policy.values())
+    fields = {}
+    # with a single asset hoisting only moves bytes around
+    if len(assets) > 1:
+      for field, value in assets[0].items():
+        if field in policy or not all(field in asset and asset[field] == value for asset in assets[1:]):
+          continue
+        fields[field] = value
+    hoisted[policy_id] = fields
+    compacted[policy_id] = {asset_id: {k: v for k, v in asset.items() if k not in fields} for asset_id, asset in policy.items()}
+    compacted[policy_id].update(fields)
+  return {nft_label: compacted}, hoisted
+
+def entry_size(key, value):
+  return len(encode(key)) + len(encode(value, str(key)))
+
+def size_report(documents):
+  # CBOR bytes of every asset, alone and in one compact document minting them all
+  merged = merge(documents)
+  compacted, hoisted = compact(merged)
+  compacted_policies = policies(compacted)
+  assets = []
+  for policy_id, policy in policies(merged).items():
+    shared_bytes = sum(entry_size(k, v) for k, v in hoisted[policy_id].items())
+    n = len(policy)
+    for asset_id, asset in policy.items():
+      size = entry_size(asset_id, asset)
+      compact_size = entry_size(asset_id, compacted_policies[policy_id][asset_id])
+      assets.append({
+        "policy_id": policy_id,
+        "asset_id": asset_id,
+        "bytes": size,
+        "compact_bytes": compact_size,
+        # the hoisted fields are paid once per policy, split evenly over its assets
+        "saved_bytes": size - compact_size - shared_bytes / n,
+      })
+  return {
+    "assets": assets,
+    "hoisted": sorted(set(field for fields in hoisted.values() for field in fields)),
+    "bytes": len(encode_metadata(merged)),
+    "compact_bytes": len(encode_metadata(compacted)),
+    "single_asset_bytes": sum(len(encode_metadata(d)) for d in documents),
+  }
+
+def head_size(n):
+  return len(encode_head(0, n))
+
+def value_bytes(asset_id):
+  # what minting an asset adds outside the metadata: its name and quantity in the mint field and
+  # again in the output receiving it, with the quantity counted at its 9 byte maximum
+  return 2 * (len(encode(asset_id.encode('utf-8'))) + 9)
+
+def pack(documents, max_bytes=max_tx_bytes - tx_overhead_bytes):
+  # packs the assets of documents into as few documents as possible whose metadata plus value_bytes
+  # of their assets fit max_bytes, first fit decreasing on the measured size of every asset
+  merged = merge(documents)
+  # assets keep their document order within a batch, batches are filled biggest asset first
+  items = []
+  for policy_id, policy in policies(merged).items():
+    for asset_id, asset in policy.items():
+      size = entry_size(asset_id, asset) + value_bytes(asset_id)
+      items.append((len(items), policy_id, asset_id, asset, size))
+  # the 721 map head grows by at most 2 bytes, policy map heads are counted at their largest
+  fixed = len(encode_metadata({nft_label: shared_fields(merged)})) + 2
+  def policy_bytes(policy_id):
+    return len(encode(policy_id)) + head_size(len(items))
+
+  bins = []
+  # bins with room left for at least the smallest asset, so the scan stays short on big drops
+  open_bins = []
+  smallest = min((item[4] for item in items), default=0)
+  for item in sorted(items, key=lambda item: -item[4]):
+    index, policy_id, asset_id, asset, size = item
+    for b in open_bins:
+      cost = size + (0 if policy_id in b["policies"] else policy_bytes(policy_id))
+      if b["bytes"] + cost <= max_bytes:
+        break
+    else:
+      b = {"bytes": fixed, "policies": set(), "items": []}
+      cost = size + policy_bytes(policy_id)
+      if fixed + cost > max_bytes:
+        raise ValueError("Asset {} needs {} bytes, more than the {} bytes a transaction has for it".format(asset_id, fixed + cost, max_bytes))
+      bins.append(b)
+      open_bins.append(b)
+    b["bytes"] += cost
+    b["policies"].add(policy_id)
+    b["items"].append(item)
+    if b["bytes"] + smallest > max_bytes:
+      open_bins.remove(b)
+
+  batches = []
+  for b in bins:
+    document = {nft_label: shared_fields(merged)}
+    for index, policy_id, asset_id, asset, size in sorted(b["items"]):
+      document[nft_label].setdefault(policy_id, {})[asset_id] = asset
+    asset_ids = [item[2] for item in sorted(b["items"])]
+    tx_bytes = len(encode_metadata(document)) + sum(value_bytes(a) for a in asset_ids)
+    # the estimate above is an upper bound, check the real encoding all the same
+    if tx_bytes > max_bytes:
+      raise ValueError("Batch of {} assets is {} bytes > {}".format(len(asset_ids), tx_bytes, max_bytes))
+    batches.append((document, asset_ids))
+  return batches
+
+def add_arguments(parser):
+  parser.add_argument("--report", help="write the sizes as JSON to this path")
+
+def run(project, args):
+  documents = []
+  for row in project.static_index:
+    onchain = project.artifact(row["nanoid"], "onchain.json")
+    if onchain is not None:
+      documents.append(onchain)
+  if not documents:
+    print("No onchain.json found, run generate_database.py first")
+    return 1
+  report = size_report(documents)
+  for a in report["assets"]:
+    print("{:<32} {:>6} bytes, {:>6} compact, {:>7.1f} saved".format(a["asset_id"], a["bytes"], a["compact_bytes"], a["saved_bytes"]))
+  print("{} assets: {} bytes as single asset transactions, {} bytes in one transaction, {} compact (hoisting {})".format(
+    len(report["assets"]), report["single_asset_bytes"], report["bytes"], report["compact_bytes"], ", ".join(report["hoisted"]) or "nothing"))
+  if args.report:
+    with open(args.report, 'w') as f:
+      json.dump(report, f, indent=2)
+
+def main():
+  parser = argparse.ArgumentParser(description="Report the CBOR size of the on-chain metadata of every product")
+  add_project_arguments(parser)
+  add_arguments(parser)
+  args = parser.parse_args()
+  project = project_from_args(args)
+  try:
+    failed = run(project, args)
+  finally:
+    project.close()
+  if failed:
+    sys.exit(1)
+
+if __name__ == "__main__":
+  main()
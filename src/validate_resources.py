@@ -1,21 +1,14 @@
-import requests
 import json
-import urllib.request
-import pandas as pd
 import os
-from pathlib import Path
-from PIL import Image
+import sys
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from image_header import image_size
+from project import add_project_arguments, project_from_args
 
-script_dir = os.path.dirname(os.path.realpath(__file__))
-index_dir = os.path.join(script_dir, "../index")
-
-static_og_dir = os.path.join(script_dir, "../static")
-static_cdn_dir = os.path.join(script_dir, "../constructed_cdn_static")
-static_ipfs_dir = os.path.join(script_dir, "../constructed_ipfs_static")
-static_sia_dir = os.path.join(script_dir, "../constructed_sia_static")
-
-static_csv = os.path.join(index_dir, "index.csv")
-df = pd.read_csv(static_csv, ",")
+# trees that can be validated, the originals in static/ and each constructed mirror
+mirrors = ["static", "cdn", "ipfs", "sia"]
 
 mb_to_bytes = 1e6
 
@@ -46,54 +39,214 @@ image_resource_specifications = {
   },
 }
 
+resources = ['card_low.jpg', 'card.png', 'artwork_low.jpg', 'artwork.png', 'video.mp4', 'character.json']
+
+# each check returns a list of problems, an empty list means it passed
+
 def validate_file_size(filename, r_path):
   if not filename in image_resource_specifications:
-    return
+    return []
 
+  problems = []
   size = os.path.getsize(r_path)
   spec_max_size = image_resource_specifications[filename]["max_size"]
   spec_min_size = image_resource_specifications[filename]["min_size"]
   if size > spec_max_size:
-    print("Size too big for {}: actual ({}) > spec ({})".format(filename, size, spec_max_size))
+    problems.append("Size too big for {}: actual ({}) > spec ({})".format(filename, size, spec_max_size))
   if size < spec_min_size:
-    print("Size too small for {}: actual ({}) > spec ({})".format(filename, size, spec_max_size))
+    problems.append("Size too small for {}: actual ({}) < spec ({})".format(filename, size, spec_min_size))
+  return problems
 
 def validate_image_dimensions(filename, r_path):
   if not filename in image_resource_specifications:
-    return
+    return []
 
-  im = Image.open(r_path)
-  width, height = im.size
+  width, height = image_size(r_path)
   spec_width = int(image_resource_specifications[filename]["width"])
   spec_height = int(image_resource_specifications[filename]["height"])
   if width != spec_width or height != spec_height:
-    print("Dimensions for {} do not match spec: actual ({},{}) != spec ({},{})".format(filename, width, height, spec_width, spec_height))
+    return ["Dimensions for {} do not match spec: actual ({},{}) != spec ({},{})".format(filename, width, height, spec_width, spec_height)]
+  return []
+
+def validate_not_empty(filename, r_path):
+  if os.path.getsize(r_path) < 10:
+    return ["Found empty file: {}".format(r_path)]
+  return []
+
+def validate_character_json(filename, r_path, name):
+  if filename != 'character.json':
+    return []
+  with open(r_path, 'r') as f:
+    j = json.load(f)
+  if j["name"] != name:
+    return ["Mismatched character JSON: {}".format(r_path)]
+  return []
+
+def run_check(check, fn, *args):
+  start = time.perf_counter()
+  try:
+    problems = fn(*args)
+    status = "fail" if problems else "pass"
+  except Exception as e:
+    problems = ["{}: {}".format(type(e).__name__, e)]
+    status = "error"
+  return {
+    "check": check,
+    "status": status,
+    "messages": problems,
+    "seconds": time.perf_counter() - start,
+  }
+
+def validate_resource(task):
+  # task is a (mirror, product_dir, nanoid, name, resource) tuple
+  mirror, product_dir, nanoid, name, r = task
+  r_path = os.path.join(product_dir, "resource", r)
+  result = {
+    "mirror": mirror,
+    "nanoid": nanoid,
+    "name": name,
+    "resource": r,
+    "path": r_path,
+    "checks": [],
+  }
+  if not os.path.isfile(r_path):
+    result["checks"].append({
+      "check": "exists",
+      "status": "warning",
+      "messages": ["Warning: {} does not exist".format(r)],
+      "seconds": 0,
+    })
+    return result
+
+  result["checks"].append(run_check("not_empty", validate_not_empty, r, r_path))
+  result["checks"].append(run_check("file_size", validate_file_size, r, r_path))
+  result["checks"].append(run_check("image_dimensions", validate_image_dimensions, r, r_path))
+  result["checks"].append(run_check("character_json", validate_character_json, r, r_path, name))
+  return result
+
+def validate_divergence(results, hash_cache, jobs):
+  # every mirrored copy must have the same bytes as the original in static/,
+  # compared through the hash cache so unchanged files aren't read again
+  present = [r for r in results if os.path.isfile(r["path"])]
+  multihashes = hash_cache.get_multihashes([r["path"] for r in present], jobs=jobs)
+  original = {(r["nanoid"], r["resource"]): multihashes[r["path"]] for r in present if r["mirror"] == "static"}
+  for r in present:
+    if r["mirror"] == "static":
+      continue
+    start = time.perf_counter()
+    expected = original.get((r["nanoid"], r["resource"]))
+    actual = multihashes[r["path"]]
+    if expected is None:
+      check = {"check": "divergence", "status": "warning", "messages": ["Warning: {} is not in static, nothing to compare against".format(r["resource"])]}
+    elif actual != expected:
+      check = {"check": "divergence", "status": "fail", "messages": ["{} differs from static: {} != {}".format(r["path"], actual, expected)]}
+    else:
+      check = {"check": "divergence", "status": "pass", "messages": []}
+    check["seconds"] = time.perf_counter() - start
+    r["checks"].append(check)
+
+def summarize(results, seconds):
+  counts = {"pass": 0, "fail": 0, "error": 0, "warning": 0}
+  for r in results:
+    for c in r["checks"]:
+      counts[c["status"]] += 1
+  return {"seconds": seconds, "resources": len(results), "checks": counts}
+
+def write_junit(path, results):
+  from xml.etree import ElementTree
+  root = ElementTree.Element("testsuites")
+  suites = {}
+  for r in results:
+    if r["mirror"] not in suites:
+      suites[r["mirror"]] = ElementTree.SubElement(root, "testsuite", name=r["mirror"])
+    suite = suites[r["mirror"]]
+    for c in r["checks"]:
+      case = ElementTree.SubElement(suite, "testcase",
+        classname="{}.{}".format(r["mirror"], r["nanoid"]),
+        name="{}.{}".format(r["resource"], c["check"]),
+        time="{:.6f}".format(c["seconds"]))
+      if c["status"] in ("fail", "error"):
+        tag = "failure" if c["status"] == "fail" else "error"
+        ElementTree.SubElement(case, tag, message=c["messages"][0]).text = "\n".join(c["messages"])
+      elif c["status"] == "warning":
+        ElementTree.SubElement(case, "skipped", message=c["messages"][0])
+  for suite in suites.values():
+    cases = suite.findall("testcase")
+    suite.set("tests", str(len(cases)))
+    suite.set("failures", str(len([c for c in cases if c.find("failure") is not None])))
+    suite.set("errors", str(len([c for c in cases if c.find("error") is not None])))
+    suite.set("skipped", str(len([c for c in cases if c.find("skipped") is not None])))
+    suite.set("time", "{:.6f}".format(sum(float(c.get("time")) for c in cases)))
+  ElementTree.ElementTree(root).write(path, encoding="utf-8", xml_declaration=True)
+
+def add_arguments(parser):
+  parser.add_argument("--mirrors", nargs="+", choices=mirrors, default=mirrors, help="trees to validate")
+  parser.add_argument("--report", help="write a JSON report to this path")
+  parser.add_argument("--junit", help="write a JUnit XML report to this path")
+  parser.add_argument("--strict", action="store_true", help="treat warnings (e.g. missing files) as failures")
+
+def validate(project, selected=mirrors):
+  # returns (results, summary) of every check on every resource of the selected trees
+  mirror_dirs = dict(project.mirror_dirs, static=project.static_dir)
+  start = time.perf_counter()
+  tasks = []
+  for mirror in selected:
+    mirror_dir = mirror_dirs[mirror]
+    if not os.path.isdir(mirror_dir):
+      print("Warning: {} does not exist, skipping".format(mirror_dir))
+      continue
+    for row in project.static_index:
+      for r in resources:
+        tasks.append((mirror, project.product_dir(row["nanoid"], mirror_dir), row["nanoid"], row["name"], r))
+
+  with ThreadPoolExecutor(max_workers=project.jobs) as executor:
+    results = list(executor.map(validate_resource, tasks))
+  validate_divergence(results, project.hash_cache, project.jobs)
+
+  # checks run on a thread pool, so each product is recorded with the summed time of its checks
+  products = {}
+  for r in results:
+    product = products.setdefault(r["nanoid"], {"seconds": 0, "checks": 0, "failed": 0})
+    for c in r["checks"]:
+      product["seconds"] += c["seconds"]
+      product["checks"] += 1
+      product["failed"] += c["status"] in ("fail", "error")
+  for nanoid, metrics in products.items():
+    project.profiler.record(nanoid, **metrics)
+  return results, summarize(results, time.perf_counter() - start)
+
+def run(project, args):
+  results, summary = validate(project, args.mirrors)
+
+  for r in results:
+    for c in r["checks"]:
+      for m in c["messages"]:
+        print("[{}] {} {}: {}".format(r["mirror"], r["name"], r["resource"], m))
+  print(json.dumps(summary))
+
+  if args.report:
+    with open(args.report, 'w') as f:
+      json.dump({"summary": summary, "results": results}, f, indent=2)
+  if args.junit:
+    write_junit(args.junit, results)
+
+  failed = summary["checks"]["fail"] + summary["checks"]["error"]
+  if args.strict:
+    failed += summary["checks"]["warning"]
+  return failed
 
 def main():
-  for static_dir in [static_og_dir, static_cdn_dir, static_ipfs_dir, static_sia_dir]:
-    print("\nTesting {}\n".format(static_dir))
-    for _, row in df.iterrows():
-      resource_dir = os.path.join(static_dir, row["nanoid"], "resource")
-      print("\n\nValidating {}".format(row["name"]))
-      for r in ['card_low.jpg', 'card.png', 'artwork_low.jpg', 'artwork.png', 'video.mp4', 'character.json']:
-        r_path = Path(os.path.join(resource_dir, r))
-        
-        if not r_path.is_file():
-          print("Warning: {} does not exist".format(r))
-          continue
-        
-        size = os.path.getsize(r_path)
-        if size < 10:
-          print("Found empty file: {}".format(r_path))
-
-        validate_file_size(r, r_path)
-        validate_image_dimensions(r, r_path)
-
-        if r == 'character.json':
-          with open(r_path, 'r') as f:
-            j = json.load(f)
-            if j["name"] != row["name"]:
-              raise ValueError("Mismatched character JSON: {}".format(r_path))
+  parser = argparse.ArgumentParser(description="Validate the original and mirrored static trees against the resource specifications")
+  add_project_arguments(parser)
+  add_arguments(parser)
+  args = parser.parse_args()
+  project = project_from_args(args)
+  try:
+    failed = run(project, args)
+  finally:
+    project.close()
+  if failed:
+    sys.exit(1)
 
 if __name__ == '__main__':
   main()